@@ -0,0 +1,90 @@
+# encoding: utf-8
+# Sorting of the version strings as Package.files and the API handlers
+# do it: python benchmarks/sort_versions.py [count]
+from __future__ import print_function
+import random
+import sys
+import timeit
+import warnings
+
+from pypi_server.hash_version import HashVersion
+
+
+# distutils is deprecated, it's gone in Python 3.12
+warnings.simplefilter("ignore", DeprecationWarning)
+
+try:
+    from distutils.version import LooseVersion
+except ImportError:
+    LooseVersion = None
+
+
+def versions(count, seed=0):
+    rnd = random.Random(seed)
+    suffixes = ('', '', '', 'a1', 'b2', 'rc1', '.post1', '.dev3', 'rc2.dev1', '+local.7')
+
+    return [
+        "%d.%d.%d%s" % (
+            rnd.randint(0, 20), rnd.randint(0, 30), rnd.randint(0, 50), rnd.choice(suffixes)
+        )
+        for _ in range(count)
+    ]
+
+
+if LooseVersion is not None:
+    # HashVersion before the PEP 440 parser
+    class LegacyHashVersion(LooseVersion):
+        def __init__(self, vstring=None):
+            LooseVersion.__init__(self, vstring=vstring)
+            self.version = tuple(map(str, self.version))
+
+        def __hash__(self):
+            return hash(self.__str__())
+
+        def __eq__(self, other):
+            if not isinstance(other, LegacyHashVersion):
+                other = LegacyHashVersion(str(other))
+
+            return tuple(self.version) == tuple(other.version)
+
+        def __lt__(self, other):
+            if not isinstance(other, LegacyHashVersion):
+                other = LegacyHashVersion(str(other))
+
+            return tuple(self.version) < tuple(other.version)
+
+
+def bench(name, cls, strings, number):
+    def parse_and_sort():
+        sorted(cls(v) for v in strings)
+
+    parsed = [cls(v) for v in strings]
+
+    def sort():
+        sorted(parsed)
+
+    def sort_by_key():
+        sorted(parsed, key=lambda x: x.version)
+
+    for title, func in (("parse + sort", parse_and_sort), ("sort", sort), ("sort by key", sort_by_key)):
+        best = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print("%-18s %-14s %8.2f ms" % (name, title, best * 1000))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    strings = versions(count)
+
+    print("Sorting %d versions" % count)
+
+    if LooseVersion is not None:
+        bench("LegacyHashVersion", LegacyHashVersion, strings, 5)
+    else:
+        print("distutils is not available, skipping the LooseVersion based one")
+
+    HashVersion.KEYS.clear()
+    bench("HashVersion", HashVersion, strings, 5)
+
+
+if __name__ == '__main__':
+    main()
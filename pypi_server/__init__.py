@@ -1,5 +1,6 @@
 # encoding: utf-8
 import os
+import re
 import sys
 
 PY2 = (sys.version_info < (3,))
@@ -15,3 +16,8 @@ __version__ = ".".join(map(str, version_info))
 __author__ = ", ".join("{0} <{1}>".format(*author) for author in author_info)
 
 ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+# PEP 503: runs of "-", "_" and "." are the same single "-"
+def normalize_package_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
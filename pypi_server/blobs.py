@@ -0,0 +1,113 @@
+# encoding: utf-8
+import errno
+import logging
+import os
+
+
+log = logging.getLogger(__name__)
+
+
+# Content-addressed storage of package files. The bytes live once under
+# <storage>/.blobs/ab/cd/<sha256>, the package paths are hardlinks to them.
+# Stored files are never modified in place (they're replaced by rename),
+# so the links are safe to share. The link count of a blob is its
+# reference count: a blob with a single link is garbage.
+class Blobs(object):
+    ROOT = None
+    DIRNAME = '.blobs'
+
+    # No hardlinks on the filesystem, the files are kept as is
+    UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.ENOSYS)
+
+    @classmethod
+    def configure(cls, storage):
+        cls.ROOT = os.path.join(storage, cls.DIRNAME)
+
+    @classmethod
+    def enabled(cls):
+        return cls.ROOT is not None
+
+    @classmethod
+    def path(cls, sha256):
+        return os.path.join(cls.ROOT, sha256[:2], sha256[2:4], sha256)
+
+    @classmethod
+    def link(cls, path, sha256):
+        blob = cls.path(sha256)
+        dirname = os.path.dirname(blob)
+
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        # The blob may disappear between the attempts by the GC of another process
+        for _ in range(3):
+            try:
+                # The first copy of the content becomes the blob
+                os.link(path, blob)
+                return False
+            except OSError as e:
+                if e.errno in cls.UNSUPPORTED:
+                    log.warning("Hardlinks aren't supported for %r: %r", path, e)
+                    return False
+                elif e.errno != errno.EEXIST:
+                    raise
+
+            if os.path.samefile(path, blob):
+                return False
+
+            if os.path.getsize(path) != os.path.getsize(blob):
+                log.error("Blob %r doesn't match %r, keeping the file", blob, path)
+                return False
+
+            temp = "%s.link" % path
+
+            try:
+                os.link(blob, temp)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+
+            os.rename(temp, path)
+            log.debug("File %r is deduplicated by %r", path, blob)
+            return True
+
+        return False
+
+    @classmethod
+    def release(cls, sha256):
+        blob = cls.path(sha256)
+
+        try:
+            if os.stat(blob).st_nlink < 2:
+                os.remove(blob)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    @classmethod
+    def collect(cls):
+        removed = 0
+        freed = 0
+
+        for root, dirs, files in os.walk(cls.ROOT):
+            for name in files:
+                path = os.path.join(root, name)
+
+                try:
+                    stat = os.stat(path)
+
+                    if stat.st_nlink < 2:
+                        os.remove(path)
+                        removed += 1
+                        freed += stat.st_size
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+
+        log.info("Blobs GC removed %d blobs (%d bytes)", removed, freed)
+        return removed, freed
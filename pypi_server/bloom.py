@@ -0,0 +1,60 @@
+# encoding: utf-8
+import hashlib
+import math
+import struct
+import threading
+from six import text_type
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate=0.001):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+
+        capacity = max(int(capacity), 1)
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(int(round(self.bits / float(capacity) * math.log(2))), 1)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.__data = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item):
+        if isinstance(item, text_type):
+            item = item.encode('utf-8')
+
+        # Double hashing, k positions from two 64 bit halves of a digest
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(item).digest())
+
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+
+        with self.lock:
+            for pos in positions:
+                self.__data[pos >> 3] |= 1 << (pos & 7)
+
+            self.count += 1
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        data = self.__data
+        return all(data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+    def info(self):
+        return {
+            'capacity': self.capacity,
+            'count': self.count,
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'error_rate': self.error_rate,
+        }
@@ -1,15 +1,23 @@
 # encoding: utf-8
+import bisect
+import hashlib
+import heapq
 import logging
 import os
 import signal
+import sqlite3
+import sys
+import threading
+from copy import copy
 from time import time
 from functools import wraps
 from inspect import isgeneratorfunction
-from collections import defaultdict
-from multiprocessing import RLock
-from tornado.gen import Return, sleep
-from tornado.ioloop import IOLoop
-from tornado.locks import Lock
+from collections import defaultdict, namedtuple, OrderedDict
+from datetime import timedelta
+from six import binary_type, integer_types, text_type
+from tornado.concurrent import Future, futures
+from tornado.gen import Return, TimeoutError, coroutine, sleep, with_timeout
+from tornado.ioloop import IOLoop, PeriodicCallback
 
 
 try:
@@ -22,6 +30,29 @@ FunctionType = type(lambda: None)
 log = logging.getLogger("cache")
 
 
+# Unlike hash() this doesn't change between processes, so the keys of the
+# disk cache survive restarts and are shared by workers.
+def canonical(obj):
+    if isinstance(obj, (list, tuple)):
+        return u"(%s)" % u",".join(map(canonical, obj))
+
+    if isinstance(obj, dict):
+        return u"{%s}" % u",".join(sorted(
+            u"%s:%s" % (canonical(k), canonical(v)) for k, v in obj.items()
+        ))
+
+    if isinstance(obj, (set, frozenset)):
+        return u"<%s>" % u",".join(sorted(map(canonical, obj)))
+
+    if isinstance(obj, (type, FunctionType)):
+        return u"%s.%s" % (obj.__module__, obj.__name__)
+
+    if obj is None or isinstance(obj, (bool, float, text_type, binary_type) + integer_types):
+        return u"%s:%r" % (type(obj).__name__, obj)
+
+    return u"%s.%s:%s" % (type(obj).__module__, type(obj).__name__, text_type(obj))
+
+
 class Result(object):
     def __init__(self, result):
         self.__result = result
@@ -35,186 +66,904 @@ class Result(object):
     def ts(self):
         return self.__ts
 
+    def sizeof(self):
+        return sizeof(self.__result)
+
+
+# A cached miss: the raised error or an empty result of a coroutine
+class Negative(Result):
+    def __init__(self, result=None, error=None):
+        super(Negative, self).__init__(result)
+        self.__error = error
+
+    @property
+    def result(self):
+        if self.__error is not None:
+            # A copy has no traceback, it doesn't grow on every hit
+            raise copy(self.__error)
+
+        return super(Negative, self).result
+
+
+def sizeof(obj):
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(i) for i in obj)
+
+    return size
+
+
+class MemoryStorage(object):
+    LRU = 'lru'
+    LFU = 'lfu'
+    POLICIES = (LRU, LFU)
+
+    def __init__(self, max_entries=None, max_size=None, policy=LRU):
+        self.lock = threading.RLock()
+        self.evictions = 0
+        self.rejections = 0
+        self.clear()
+        self.configure(max_entries, max_size, policy)
+
+    def configure(self, max_entries=None, max_size=None, policy=LRU):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown eviction policy %r" % policy)
+
+        with self.lock:
+            self.max_entries = max_entries
+            self.max_size = max_size
+            self.policy = policy
+
+            return self._evict()
+
+    def clear(self):
+        with self.lock:
+            # key -> [value, size, frequency, expires, groups]
+            self.__entries = {}
+            # group -> keys, lets invalidation skip the unrelated entries
+            self.__groups = defaultdict(set)
+            # frequency -> keys in access order
+            self.__buckets = defaultdict(OrderedDict)
+            self.__min_freq = 0
+            # heap of (expires, key), items of replaced entries are skipped
+            self.__expiry = []
+            self.size = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def keys(self):
+        with self.lock:
+            return list(self.__entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.__entries.get(key)
+
+            if entry is None:
+                return default
+
+            if entry[3] is not None and entry[3] <= time():
+                self.pop(key)
+                return default
+
+            self._touch(key, entry)
+            return entry[0]
+
+    def put(self, key, value, expires=None, groups=()):
+        size = value.sizeof() if isinstance(value, Result) else sizeof(value)
+
+        with self.lock:
+            self.pop(key)
+
+            if self.max_size and size > self.max_size:
+                self.rejections += 1
+                log.debug("Cache entry %r is larger than the whole cache (%d bytes)", key, size)
+                return []
+
+            evicted = self._evict(1, size)
+
+            self.__entries[key] = [value, size, 0, expires, groups]
+            self.__buckets[0][key] = None
+
+            for group in groups:
+                self.__groups[group].add(key)
+
+            self.__min_freq = 0
+            self.size += size
+
+            if expires is not None:
+                heapq.heappush(self.__expiry, (expires, key))
+
+                # Too many items of replaced and evicted entries
+                if len(self.__expiry) > 2 * len(self.__entries) + 1024:
+                    self.__expiry = [(e[3], k) for k, e in self.__entries.items() if e[3] is not None]
+                    heapq.heapify(self.__expiry)
+
+            return evicted
+
+    def expire(self, now=None):
+        now = time() if now is None else now
+        expired = []
+
+        with self.lock:
+            while self.__expiry and self.__expiry[0][0] <= now:
+                expires, key = heapq.heappop(self.__expiry)
+                entry = self.__entries.get(key)
+
+                if entry is not None and entry[3] == expires:
+                    self.pop(key)
+                    expired.append(key)
+
+        return expired
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.__entries.pop(key, None)
+
+            if entry is None:
+                return default
+
+            value, size, freq, expires, groups = entry
+            self.size -= size
+            self._unlink(key, freq)
+
+            for group in groups:
+                keys = self.__groups.get(group)
+
+                if keys is not None:
+                    keys.discard(key)
+
+                    if not keys:
+                        del self.__groups[group]
+
+            return value
+
+    def group_info(self, group):
+        with self.lock:
+            keys = self.__groups.get(group, ())
+            return len(keys), sum(self.__entries[key][1] for key in keys)
+
+    def pop_group(self, group):
+        with self.lock:
+            keys = list(self.__groups.get(group, ()))
+
+            for key in keys:
+                self.pop(key)
+
+            return keys
+
+    def _unlink(self, key, freq):
+        bucket = self.__buckets[freq]
+        bucket.pop(key, None)
+
+        if not bucket:
+            self.__buckets.pop(freq, None)
+
+    def _touch(self, key, entry):
+        freq = entry[2]
+        self._unlink(key, freq)
+
+        if self.policy == self.LFU:
+            if freq == self.__min_freq and freq not in self.__buckets:
+                self.__min_freq = freq + 1
+
+            freq += 1
+            entry[2] = freq
+
+        self.__buckets[freq][key] = None
+
+    def _overflow(self, entries=0, size=0):
+        if self.max_entries and len(self.__entries) + entries > self.max_entries:
+            return True
+
+        if self.max_size and self.size + size > self.max_size:
+            return True
+
+        return False
+
+    def _evict(self, entries=0, size=0):
+        evicted = []
+
+        while self.__entries and self._overflow(entries, size):
+            if self.__min_freq not in self.__buckets:
+                self.__min_freq = min(self.__buckets)
+
+            key = next(iter(self.__buckets[self.__min_freq]))
+            self.pop(key)
+            self.evictions += 1
+            evicted.append(key)
+
+        if evicted:
+            log.debug("EVICTED %d Cache entries", len(evicted))
+
+        return evicted
+
+    def info(self):
+        with self.lock:
+            return {
+                'entries': len(self.__entries),
+                'groups': len(self.__groups),
+                'size': self.size,
+                'max_entries': self.max_entries,
+                'max_size': self.max_size,
+                'policy': self.policy,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+            }
+
+
+class DiskStorage(object):
+    FILENAME = 'cache.sqlite3'
+    # It's a cache, a file of another version is just dropped
+    SCHEMA_VERSION = 2
+    # Reads don't rewrite the access time of entries used recently
+    ATIME_RESOLUTION = 60
+
+    def __init__(self, max_size=None):
+        self.lock = threading.Lock()
+        self.connection = None
+        self.max_size = max_size
+        self.expirations = 0
+        self.evictions = 0
+
+    def open(self, path, max_size=None):
+        connection = sqlite3.connect(
+            os.path.join(path, self.FILENAME),
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+
+        if connection.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            connection.execute("DROP TABLE IF EXISTS cache")
+            connection.execute("PRAGMA user_version = %d" % self.SCHEMA_VERSION)
+
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, tag TEXT, ts REAL NOT NULL, "
+            "expires REAL NOT NULL, atime REAL NOT NULL, size INTEGER NOT NULL, "
+            "value BLOB NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)")
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_namespace ON cache (namespace, tag)")
+
+        with self.lock:
+            self.connection = connection
+            self.max_size = max_size
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def query(self, query, *args):
+        with self.lock:
+            # Without a cache directory only the memory storage is used
+            if self.connection is None:
+                return []
+
+            return self.connection.execute(query, args).fetchall()
+
+    def execute(self, query, *args):
+        with self.lock:
+            if self.connection is None:
+                return 0
+
+            return self.connection.execute(query, args).rowcount
+
+    def get(self, key):
+        now = time()
+        rows = self.query("SELECT value FROM cache WHERE key = ? AND expires > ?", key, now)
+
+        if not rows:
+            return None
+
+        self.execute(
+            "UPDATE cache SET atime = ? WHERE key = ? AND atime < ?",
+            now, key, now - self.ATIME_RESOLUTION
+        )
+
+        return pickle.loads(bytes(rows[0][0]))
+
+    def put(self, key, namespace, result, max_age, tag=None):
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+
+        self.execute(
+            "INSERT OR REPLACE INTO cache (key, namespace, tag, ts, expires, atime, size, value) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            key, namespace, tag, result.ts, result.ts + max_age, time(), len(data),
+            sqlite3.Binary(data)
+        )
+
+    def pop(self, key, ts=None):
+        if ts is None:
+            return self.execute("DELETE FROM cache WHERE key = ?", key)
+
+        return self.execute("DELETE FROM cache WHERE key = ? AND ts = ?", key, ts)
+
+    def pop_namespace(self, namespace, tag=None):
+        if tag is None:
+            return self.execute("DELETE FROM cache WHERE namespace = ?", namespace)
+
+        return self.execute("DELETE FROM cache WHERE namespace = ? AND tag = ?", namespace, tag)
+
+    def clear(self):
+        return self.execute("DELETE FROM cache")
+
+    def cleanup(self):
+        expired = self.execute("DELETE FROM cache WHERE expires <= ?", time())
+        evicted = 0
+        size = self.size()
+
+        if self.max_size and size > self.max_size:
+            keys = []
+
+            for key, entry_size in self.query("SELECT key, size FROM cache ORDER BY atime"):
+                if size <= self.max_size:
+                    break
+
+                keys.append(key)
+                size -= entry_size
+
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                evicted += self.execute(
+                    "DELETE FROM cache WHERE key IN (%s)" % ",".join("?" * len(chunk)),
+                    *chunk
+                )
+
+        if expired or evicted:
+            log.info("Disk cache cleanup: %d expired, %d evicted entries", expired, evicted)
+
+        self.expirations += expired
+        self.evictions += evicted
+
+        return expired, evicted
+
+    def size(self):
+        rows = self.query("SELECT COALESCE(SUM(size), 0) FROM cache")
+        return rows[0][0] if rows else 0
+
+    def info(self):
+        rows = self.query("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache")
+        entries, size = rows[0] if rows else (0, 0)
+        return {
+            'entries': entries,
+            'size': size,
+            'max_size': self.max_size,
+            'expirations': self.expirations,
+            'evictions': self.evictions,
+        }
+
+    def namespaces(self):
+        return dict(
+            (namespace, {'entries': entries, 'size': size})
+            for namespace, entries, size in self.query(
+                "SELECT namespace, COUNT(*), SUM(size) FROM cache GROUP BY namespace"
+            )
+        )
+
+
+Key = namedtuple('Key', ('namespace', 'tag', 'digest'))
+
+
+class Stats(object):
+    # Upper bounds (seconds) of the execution time histogram of misses
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+    COUNTERS = (
+        'hits', 'negative_hits', 'disk_hits', 'stale', 'misses', 'errors', 'waits', 'wait_timeouts',
+        'refreshes', 'refresh_errors', 'evictions', 'expirations',
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+            self.histogram = [0] * (len(self.BUCKETS) + 1)
+            self.miss_time = 0.0
+            self.hit_time = 0.0
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def hit(self, name, duration):
+        with self.lock:
+            self.counters[name] += 1
+            self.hit_time += duration
+
+    def miss(self, duration):
+        with self.lock:
+            self.counters['misses'] += 1
+            self.histogram[bisect.bisect_left(self.BUCKETS, duration)] += 1
+            self.miss_time += duration
+
+    def snapshot(self):
+        with self.lock:
+            result = dict(self.counters)
+            lookups = result['hits'] + result['negative_hits'] + result['stale'] + result['misses']
+
+            result.update({
+                'hit_ratio': float(lookups - result['misses']) / lookups if lookups else None,
+                'hit_time': self.hit_time,
+                'miss_time': self.miss_time,
+                'miss_histogram': [
+                    [bound, count] for bound, count in zip(self.BUCKETS + ('inf',), self.histogram)
+                ],
+            })
+
+            return result
+
+
+class Generations(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Entries of the previous runs (disk cache) never match, the database
+        # might be changed meanwhile.
+        self.token = hashlib.sha1(os.urandom(16)).hexdigest()[:16]
+        # Changes of everything
+        self.epoch = 0
+        # Changes of any tag, for entries without a tag (e.g. lists)
+        self.any = 0
+        self.tags = {}
+
+    def get(self, tag=None):
+        with self.lock:
+            if tag is None:
+                return u"%s:%d:%d" % (self.token, self.epoch, self.any)
+
+            return u"%s:%d:%s:%d" % (self.token, self.epoch, tag, self.tags.get(tag, 0))
+
+    def bump(self, tag=None):
+        with self.lock:
+            if tag is None:
+                self.epoch += 1
+            else:
+                self.tags[tag] = self.tags.get(tag, 0) + 1
+
+            self.any += 1
+
+    def info(self):
+        with self.lock:
+            return {
+                'epoch': self.epoch,
+                'any': self.any,
+                'tags': len(self.tags),
+            }
+
+
+class Flight(object):
+    __slots__ = ('key', 'future', 'waiters', 'ts')
+
+    def __init__(self, key, future):
+        self.key = key
+        self.future = future
+        self.waiters = 0
+        self.ts = time()
+
 
 class Cache(object):
-    __slots__ = ('timeout', 'ignore_self', 'oid', 'files_cache')
+    __slots__ = (
+        'timeout', 'ignore_self', 'oid', 'files_cache', 'hard_timeout', 'wait_timeout', 'tag', 'generational',
+        'negative_timeout', 'stats'
+    )
+
+    MAX_ENTRIES = 100000
+    MAX_SIZE = 512 * 1024 * 1024
+    NEGATIVE_MAX_ENTRIES = 10000
+    NEGATIVE_ERRORS = (LookupError,)
+    DISK_MAX_SIZE = 1024 * 1024 * 1024
+    SWEEPER_INTERVAL = 10
+    JANITOR_INTERVAL = 5 * 60
 
     CACHE_DIR = None
-    CACHE = {}
-    FUTURE_LOCKS = defaultdict(Lock)
-    RLOCKS = defaultdict(RLock)
+    CACHE = MemoryStorage(MAX_ENTRIES, MAX_SIZE)
+    # Misses have their own storage, a flood of unknown names can't evict
+    # the entries of existing ones.
+    NEGATIVE = MemoryStorage(NEGATIVE_MAX_ENTRIES)
+    DISK = DiskStorage(DISK_MAX_SIZE)
+    DISK_POOL = futures.ThreadPoolExecutor(1)
+    SWEEPER = None
+    JANITOR = None
+    # Calls in progress, concurrent callers of the same key share their result
+    FLIGHTS = {}
+    FLIGHTS_LOCK = threading.Lock()
+    REFRESHING = set()
+    # namespace -> decorator, used to build the tags for invalidation
+    NAMESPACES = {}
+    GENERATIONS = Generations()
+
+    def __init__(self, timeout, ignore_self=False, oid=None, files_cache=False, hard_timeout=None,
+                 wait_timeout=None, tag=None, generational=False, negative_timeout=None):
+        if hard_timeout is not None and hard_timeout < timeout:
+            raise ValueError("hard_timeout must not be less than timeout")
 
-    def __init__(self, timeout, ignore_self=False, oid=None, files_cache=False):
         self.timeout = timeout
         self.ignore_self = ignore_self
         self.oid = oid
         self.files_cache = files_cache
+        # Coroutines only: an expired value is served until hard_timeout
+        # while a single background call refreshes it.
+        self.hard_timeout = hard_timeout
+        # Callers waiting longer for a concurrent call raise TimeoutError,
+        # the call itself keeps running and its result is cached.
+        self.wait_timeout = wait_timeout
+        # Callable making a tag of the first argument (e.g. package name),
+        # entries of a tag can be invalidated without touching the others.
+        self.tag = tag
+        # The key contains the generation of the tag at call time, writers
+        # call Cache.bump(tag) after commit and the old entries aren't used.
+        # A call started before the bump stores its result with the old key.
+        self.generational = generational
+        # NEGATIVE_ERRORS raised by the function (and empty results of
+        # coroutines) are cached in memory for negative_timeout.
+        self.negative_timeout = negative_timeout
+        self.stats = Stats()
+
+    @property
+    def max_age(self):
+        return self.hard_timeout or self.timeout
 
     @staticmethod
     def hash_func(key):
+        # Methods are invalidated through the class attribute
+        key = getattr(key, '__func__', key)
+
         if isinstance(key, FunctionType):
-            return ".".join((key.__module__, key.__name__))
+            return ".".join((key.__module__, getattr(key, '__qualname__', key.__name__)))
         else:
             return str(key)
 
+    def make_tag(self, value):
+        if self.tag is None:
+            return None
+
+        return text_type(self.tag(value))
+
+    @staticmethod
+    def groups(key):
+        if key.tag is None:
+            return (key.namespace,)
+
+        return key.namespace, (key.namespace, key.tag)
+
     @classmethod
-    def invalidate(cls, func):
-        fkey = cls.hash_func(func)
+    def configure(cls, max_entries=MAX_ENTRIES, max_size=MAX_SIZE, policy=MemoryStorage.LRU,
+                  negative_entries=NEGATIVE_MAX_ENTRIES):
+        log.info(
+            "Memory cache limits: %s entries, %s bytes, %s eviction, %s negative entries",
+            max_entries or 'unlimited', max_size or 'unlimited', policy, negative_entries or 'unlimited'
+        )
 
-        hash_fkey = hash(fkey)
-        for key in filter(lambda x: hash(x[0]) == hash_fkey, cls.CACHE):
-            log.debug('INVALIDATING Cache for %r', key)
-            cls.CACHE.pop(key, -1)
-            cls.FUTURE_LOCKS.pop(key, -1)
-            cls.RLOCKS.pop(key, -1)
+        cls.count(cls.CACHE.configure(max_entries, max_size, policy), 'evictions')
+        cls.count(cls.NEGATIVE.configure(negative_entries), 'evictions')
 
-    def get_cache(self, key):
-        if self.files_cache:
-            fname = self.get_cache_file(key)
+    @classmethod
+    def configure_disk(cls, cache_dir, max_size=DISK_MAX_SIZE):
+        log.info('Opening disk cache in "%s", limit %s bytes', cache_dir, max_size or 'unlimited')
 
-            if not os.path.exists(fname):
-                return None
+        cls.CACHE_DIR = cache_dir
+        cls.DISK.open(cache_dir, max_size)
 
-            with open(fname, 'rb') as f:
-                result = pickle.load(f)
+    @classmethod
+    def start(cls):
+        # Expired entries are also dropped when read, the periodic cleanup just
+        # reclaims the memory of entries nobody asks for anymore.
+        if cls.SWEEPER is None:
+            cls.SWEEPER = PeriodicCallback(cls.sweep, cls.SWEEPER_INTERVAL * 1000)
+            cls.SWEEPER.start()
+
+        if cls.JANITOR is None:
+            cls.JANITOR = PeriodicCallback(
+                lambda: cls.disk(cls.DISK.cleanup),
+                cls.JANITOR_INTERVAL * 1000
+            )
+            cls.JANITOR.start()
 
-            if result.ts < (time() - self.timeout):
-                IOLoop.current().add_callback(os.remove, fname)
-                return None
+    @classmethod
+    def sweep(cls):
+        expired = cls.CACHE.expire() + cls.NEGATIVE.expire()
 
-            return result
+        if expired:
+            log.debug("EXPIRED %d Cache entries", len(expired))
+            cls.count(expired, 'expirations')
 
-        return self.CACHE.get(key)
+        return expired
 
-    def set_cache(self, key, value):
-        if self.files_cache:
-            fname = self.get_cache_file(key)
+    @classmethod
+    def disk(cls, func, *args):
+        def on_done(future):
+            exc = future.exception()
+            if exc is not None:
+                log.error("Disk cache operation %s failed", func.__name__)
+                log.exception(exc)
+
+        future = cls.DISK_POOL.submit(func, *args)
+        future.add_done_callback(on_done)
+        return future
+
+    @classmethod
+    def info(cls):
+        return cls.CACHE.info()
+
+    @classmethod
+    def count(cls, keys, counter):
+        for key in keys:
+            cache = cls.NAMESPACES.get(key.namespace)
+
+            if cache is not None:
+                cache.stats.incr(counter)
+
+    @classmethod
+    def snapshot(cls):
+        disk = cls.DISK.namespaces()
+        functions = {}
+
+        for namespace, cache in list(cls.NAMESPACES.items()):
+            entries, size = cls.CACHE.group_info(namespace)
+            negative_entries, negative_size = cls.NEGATIVE.group_info(namespace)
+
+            info = cache.stats.snapshot()
+            info.update({
+                'memory': {'entries': entries, 'size': size},
+                'negative': {'entries': negative_entries, 'size': negative_size},
+                'disk': disk.get(namespace, {'entries': 0, 'size': 0}),
+            })
+
+            functions[namespace] = info
+
+        return {
+            'memory': cls.CACHE.info(),
+            'negative': cls.NEGATIVE.info(),
+            'disk': cls.DISK.info(),
+            'generations': cls.GENERATIONS.info(),
+            'in_flight': cls.in_flight(),
+            'functions': functions,
+        }
+
+    @classmethod
+    def bump(cls, tag=None):
+        log.debug("BUMP Cache generation of %r", tag)
+        cls.GENERATIONS.bump(tag)
+
+    @classmethod
+    def in_flight(cls):
+        with cls.FLIGHTS_LOCK:
+            flights = list(cls.FLIGHTS.values())
+
+        now = time()
+        return [
+            {'key': f.key, 'waiters': f.waiters, 'duration': now - f.ts}
+            for f in flights
+        ]
+
+    @classmethod
+    def invalidate(cls, func, *args):
+        namespace = cls.hash_func(func)
+        cache = cls.NAMESPACES.get(namespace)
+        tag = cache.make_tag(args[0]) if args and cache is not None else None
+
+        if tag is None:
+            group = namespace
+        else:
+            group = (namespace, tag)
+
+        keys = cls.CACHE.pop_group(group) + cls.NEGATIVE.pop_group(group)
+        log.debug('INVALIDATING %d Cache entries for %r', len(keys), group)
+
+        if cache is None or cache.files_cache:
+            cls.disk(cls.DISK.pop_namespace, namespace, tag)
+
+        return keys
+
+    def is_negative(self, error):
+        return bool(self.negative_timeout) and isinstance(error, self.NEGATIVE_ERRORS)
+
+    def hit(self, key, args_key, result, start_time):
+        if isinstance(result, Negative):
+            log.debug("NEGATIVE HIT Cache [%s] %r", key, args_key)
+            self.stats.hit('negative_hits', time() - start_time)
+        else:
+            log.debug("HIT Cache [%s] %r", key, args_key)
+            self.stats.hit('hits', time() - start_time)
+
+    def get_cache(self, key):
+        result = self.CACHE.get(key)
+
+        if result is None and self.negative_timeout:
+            result = self.NEGATIVE.get(key)
+
+        if result is None and self.files_cache:
+            result = self.DISK.get(key.digest)
 
-            with open(fname, 'wb+') as f:
-                pickle.dump(value, f)
+            if result is not None:
+                self.stats.incr('disk_hits')
+                self.count(self.CACHE.put(key, result, result.ts + self.max_age, self.groups(key)), 'evictions')
 
+        return result
+
+    def set_cache(self, key, value):
+        if isinstance(value, Negative):
+            storage, expires = self.NEGATIVE, value.ts + self.negative_timeout
         else:
-            self.CACHE[key] = value
+            storage, expires = self.CACHE, value.ts + self.max_age
+
+        self.count(storage.put(key, value, expires, self.groups(key)), 'evictions')
+
+        if isinstance(value, Negative):
+            return
+
+        if self.files_cache:
+            self.disk(self.DISK.put, key.digest, key.namespace, value, self.max_age, key.tag)
 
     @classmethod
     def invalidate_all(cls, *args, **kwargs):
         log.warning("Invalidating all memory cache.")
         cls.CACHE.clear()
-        cls.FUTURE_LOCKS.clear()
-        cls.RLOCKS.clear()
+        cls.NEGATIVE.clear()
 
         log.warning("Invalidating all disk cache.")
-        files = filter(
-            lambda x: os.path.isfile(x),
-            (os.path.join(cls.CACHE_DIR, f) for f in os.listdir(cls.CACHE_DIR))
-        )
-
-        for file in files:
-            try:
-                os.remove(file)
-            except Exception as e:
-                log.exception(e)
+        cls.disk(cls.DISK.clear)
 
     def __call__(self, func):
         is_generator = isgeneratorfunction(func)
+
+        if self.hard_timeout is not None and not is_generator:
+            # Plain functions have nothing to refresh the stale values in background
+            raise ValueError("hard_timeout is supported by the coroutines only")
+
         key = self.oid or self.hash_func(func)
+        self.NAMESPACES[key] = self
 
         def get_hash(func, args, kwargs):
-            return tuple(
-                map(
-                    hash,
-                    (
-                        key,
-                        tuple(map(hash, args[1:] if self.ignore_self else args)),
-                        tuple(map(lambda x: tuple(map(hash, x)), kwargs.items())),
-                        is_generator,
-                    )
-                )
-            )
+            args = args[1:] if self.ignore_self else args
+            tag = self.make_tag(args[0]) if args else None
+            parts = (key, args, kwargs, is_generator)
+
+            if self.generational:
+                parts += (self.GENERATIONS.get(tag),)
+
+            return Key(key, tag, hashlib.sha1(canonical(parts).encode('utf-8')).hexdigest())
 
         @wraps(func)
         def wrap(*args, **kwargs):
-            io_loop = IOLoop.current()
-
             args_key = get_hash(func, args, kwargs)
-            start_time = io_loop.time()
+            start_time = time()
 
-            with self.RLOCKS[args_key]:
-                ret = self.get_cache(args_key)
+            ret = self.get_cache(args_key)
+
+            if isinstance(ret, Result):
+                self.hit(key, args_key, ret, start_time)
+                return ret.result
 
-                if isinstance(ret, Result):
-                    log.debug("HIT Cache [%s] %r", key, args_key)
-                    return ret.result
+            with self.FLIGHTS_LOCK:
+                flight = self.FLIGHTS.get(args_key)
+                leader = flight is None
 
+                if leader:
+                    flight = self.FLIGHTS[args_key] = Flight(key, futures.Future())
+                else:
+                    flight.waiters += 1
+
+            if not leader:
+                log.debug("WAIT Cache [%s] %r", key, args_key)
+                self.stats.incr('waits')
+
+                try:
+                    return flight.future.result(self.wait_timeout)
+                except futures.TimeoutError:
+                    self.stats.incr('wait_timeouts')
+                    raise TimeoutError("Timeout waiting for Cache [%s] %r" % (key, args_key))
+                finally:
+                    with self.FLIGHTS_LOCK:
+                        flight.waiters -= 1
+
+            try:
                 ret = Result(func(*args, **kwargs))
                 self.set_cache(args_key, ret)
+            except Exception as e:
+                self.stats.incr('errors')
 
-                io_loop.add_callback(
-                    io_loop.call_later,
-                    self.timeout,
-                    self._expire,
-                    key,
-                    args_key
-                )
+                if self.is_negative(e):
+                    self.set_cache(args_key, Negative(error=e))
 
-                log.debug(
-                    "MISS Cache [%s] %r. Execution time %.6f sec.",
-                    key,
-                    args_key,
-                    io_loop.time() - start_time
-                )
-                return ret.result
+                flight.future.set_exception(e)
+                raise
+            else:
+                flight.future.set_result(ret.result)
+            finally:
+                with self.FLIGHTS_LOCK:
+                    self.FLIGHTS.pop(args_key, None)
+
+            duration = time() - start_time
+            self.stats.miss(duration)
+            log.debug("MISS Cache [%s] %r. Execution time %.6f sec.", key, args_key, duration)
+            return ret.result
+
+        coro = coroutine(func)
 
         @wraps(func)
         def wrap_gen(*args, **kwargs):
-            io_loop = IOLoop.current()
-
             args_key = get_hash(func, args, kwargs)
-            start_time = io_loop.time()
+            start_time = time()
 
-            with (yield self.FUTURE_LOCKS[args_key].acquire()):
+            if (self.files_cache and args_key not in self.CACHE and
+                    args_key not in self.NEGATIVE and args_key not in self.FLIGHTS):
+                ret = yield self.disk(self.get_cache, args_key)
+            else:
                 ret = self.get_cache(args_key)
 
-                if isinstance(ret, Result):
-                    yield sleep(0)
-                    log.debug("HIT Cache [%s] %r", key, args_key)
-                    raise Return(ret.result)
+            if isinstance(ret, Result):
+                yield sleep(0)
+
+                if self.hard_timeout and not isinstance(ret, Negative) and ret.ts < (time() - self.timeout):
+                    log.debug("STALE Cache [%s] %r", key, args_key)
+                    self.stats.hit('stale', time() - start_time)
+                    self.refresh(coro, key, args_key, args, kwargs)
+                else:
+                    self.hit(key, args_key, ret, start_time)
+
+                raise Return(ret.result)
+
+            flight = self.FLIGHTS.get(args_key)
 
-                gen = func(*args, **kwargs)
+            if flight is not None:
+                log.debug("WAIT Cache [%s] %r", key, args_key)
+                self.stats.incr('waits')
+                flight.waiters += 1
 
                 try:
-                    f = next(gen)
-                    while True:
-                        try:
-                            res = yield f
-                            f = gen.send(res)
-                        except (Return, StopIteration):
-                            raise
-                        except Exception as e:
-                            f = gen.throw(e)
-
-                except Return as e:
-                    ret = Result(e.value)
-                except StopIteration as e:
-                    ret = Result(getattr(e, 'value', None))
+                    if self.wait_timeout is None:
+                        result = yield flight.future
+                    else:
+                        result = yield with_timeout(timedelta(seconds=self.wait_timeout), flight.future)
+                except TimeoutError:
+                    self.stats.incr('wait_timeouts')
+                    raise
+                finally:
+                    flight.waiters -= 1
 
-                if ret.result:
-                    self.set_cache(args_key, ret)
+                raise Return(result)
 
-                    io_loop.add_callback(
-                        io_loop.call_later,
-                        self.timeout,
-                        self._expire,
-                        key,
-                        args_key
-                    )
+            flight = self.FLIGHTS[args_key] = Flight(key, Future())
 
-                    log.debug(
-                        "MISS Cache [%s] %r. Execution time %.6f sec.",
-                        key,
-                        args_key,
-                        io_loop.time() - start_time
-                    )
+            try:
+                ret = Result((yield coro(*args, **kwargs)))
+            except Exception as e:
+                self.stats.incr('errors')
+
+                if self.is_negative(e):
+                    self.set_cache(args_key, Negative(error=e))
+
+                flight.future.set_exc_info(sys.exc_info())
+                # Nobody may be waiting, the caller gets the exception anyway
+                flight.future.exception()
+                raise
+            else:
+                duration = time() - start_time
+                self.stats.miss(duration)
+
+                if ret.result:
+                    self.set_cache(args_key, ret)
+                    log.debug("MISS Cache [%s] %r. Execution time %.6f sec.", key, args_key, duration)
+                elif self.negative_timeout:
+                    self.set_cache(args_key, Negative(ret.result))
+                    log.debug("NEGATIVE MISS Cache [%s] %r", key, args_key)
                 else:
                     log.warning(
                         "Generator '%s' no return any value. Cache ignoring.",
@@ -223,22 +972,41 @@ class Cache(object):
 
                     log.debug("INVALID Cache [%s] %r", key, args_key)
 
-                raise Return(ret.result)
-
-        return wrap_gen if is_generator else wrap
+                flight.future.set_result(ret.result)
+            finally:
+                self.FLIGHTS.pop(args_key, None)
 
-    def get_cache_file(self, args_key):
-        return os.path.join(self.CACHE_DIR, str(hash(args_key)))
+            raise Return(ret.result)
 
-    def _expire(self, key, args_key):
-        if self.files_cache:
-            fname = self.get_cache_file(args_key)
-            if os.path.exists(fname):
-                os.remove(fname)
-
-        self.CACHE.pop(args_key, -1)
-        log.debug("EXPIRED Cache [%s] %r", key, args_key)
+        return wrap_gen if is_generator else wrap
 
+    def refresh(self, coro, key, args_key, args, kwargs):
+        if args_key in self.REFRESHING:
+            return
+
+        self.REFRESHING.add(args_key)
+        IOLoop.current().spawn_callback(self._refresh, coro, key, args_key, args, kwargs)
+
+    @coroutine
+    def _refresh(self, coro, key, args_key, args, kwargs):
+        start_time = time()
+        self.stats.incr('refreshes')
+
+        try:
+            result = yield coro(*args, **kwargs)
+        except Exception as e:
+            self.stats.incr('refresh_errors')
+            log.warning("Refreshing Cache [%s] %r failed, keeping the stale value: %r", key, args_key, e)
+            return
+        finally:
+            self.REFRESHING.discard(args_key)
+
+        if not result:
+            log.warning("Generator '%s' no return any value. Keeping the stale value.", key)
+            return
+
+        self.set_cache(args_key, Result(result))
+        log.debug("REFRESHED Cache [%s] %r. Execution time %.6f sec.", key, args_key, time() - start_time)
 
 signal.signal(signal.SIGUSR1, Cache.invalidate_all)
 
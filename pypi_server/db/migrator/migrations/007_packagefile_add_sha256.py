@@ -0,0 +1,18 @@
+# encoding: utf-8
+from playhouse.migrate import migrate
+from pypi_server.db.migrator import migration
+from pypi_server.db.packages import PackageFile
+
+
+@migration(10)
+def add_sha256_field(migrator, db):
+    try:
+        PackageFile.select(PackageFile.sha256).where(PackageFile.sha256 == None).count()
+    except:
+        migrate(
+            migrator.add_column(
+                'packagefile',
+                'sha256',
+                PackageFile.sha256
+            )
+        )
@@ -0,0 +1,20 @@
+# encoding: utf-8
+from peewee import OperationalError, ProgrammingError
+from playhouse.migrate import migrate
+from pypi_server.db.migrator import migration
+from pypi_server.db.packages import PackageFile
+
+
+@migration(11)
+def add_accessed_field(migrator, db):
+    try:
+        PackageFile.select(PackageFile.accessed).where(PackageFile.accessed == None).count()
+    except (OperationalError, ProgrammingError):
+        # The index of the field is created with the column
+        migrate(
+            migrator.add_column(
+                'packagefile',
+                'accessed',
+                PackageFile.accessed
+            )
+        )
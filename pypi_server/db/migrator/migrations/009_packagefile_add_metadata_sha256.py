@@ -0,0 +1,18 @@
+# encoding: utf-8
+from playhouse.migrate import migrate
+from pypi_server.db.migrator import migration
+from pypi_server.db.packages import PackageFile
+
+
+@migration(12)
+def add_metadata_sha256_field(migrator, db):
+    try:
+        PackageFile.select(PackageFile.metadata_sha256).where(PackageFile.metadata_sha256 == None).count()
+    except:
+        migrate(
+            migrator.add_column(
+                'packagefile',
+                'metadata_sha256',
+                PackageFile.metadata_sha256
+            )
+        )
@@ -1,21 +1,30 @@
 #!/usr/bin/env python
 # encoding: utf-8
-import hashlib
 import datetime
+import errno
 from functools import total_ordering
 
 import os
 import logging
+import tempfile
+import zipfile
 import peewee as p
 from multiprocessing import RLock
 from playhouse.kv import JSONField
 from playhouse import signals
-from pypi_server.cache import Cache
+from pypi_server import normalize_package_name
+from pypi_server.blobs import Blobs
+from pypi_server.bloom import BloomFilter
+from pypi_server.digest import Digest, DigestWriter
+from pypi_server.locks import try_lock, unlock
+from pypi_server.cache import Cache, DAY, MINUTE
 from pypi_server.timeit import timeit
 from pypi_server.hash_version import HashVersion
+from pypi_server.metadata import wheel_metadata
 from pypi_server.db import BaseModel
 from pypi_server.db.users import Users
-from tornado.ioloop import IOLoop
+from tornado.concurrent import futures
+from tornado.ioloop import IOLoop, PeriodicCallback
 
 
 try:
@@ -27,18 +36,68 @@ except ImportError:
 log = logging.getLogger("db.packages")
 
 
+# Cache entries of a package are tagged with its normalized name (PEP 503),
+# so any spelling of the name invalidates them.
+package_tag = normalize_package_name
+
+
+def fsync_dir(path):
+    # The rename is durable once the directory entry is on the disk
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 class File(object):
-    __slots__ = ('__close_callbacks', '__file')
+    __slots__ = ('__close_callbacks', '__file', '__name', '__temp', 'digest')
 
     def __init__(self, name, mode='rb'):
         self.__close_callbacks = set()
-        self.__file = open(name, mode)
+        self.__name = name
+        self.__temp = None
+        self.digest = None
+
+        if 'w' in mode:
+            # Written next to the target and renamed into place after fsync,
+            # so a crash never leaves a truncated file behind.
+            fd, self.__temp = tempfile.mkstemp(
+                dir=os.path.dirname(name),
+                prefix='.%s.' % os.path.basename(name),
+                suffix='.tmp'
+            )
+            os.fchmod(fd, 0o644)
+            self.__file = os.fdopen(fd, mode)
+            self.digest = Digest()
+        else:
+            self.__file = open(name, mode)
 
     def add_close_callback(self, cb):
         self.__close_callbacks.add(cb)
 
-    def close(self):
-        self.__file.close()
+    def close(self, commit=True):
+        temp, self.__temp = self.__temp, None
+
+        if temp is not None:
+            try:
+                if commit:
+                    self.__file.flush()
+                    os.fsync(self.__file.fileno())
+
+                self.__file.close()
+
+                if commit:
+                    os.rename(temp, self.__name)
+                    fsync_dir(os.path.dirname(self.__name))
+            finally:
+                if os.path.exists(temp):
+                    os.remove(temp)
+
+            if not commit:
+                return
+        else:
+            self.__file.close()
 
         for cb in list(self.__close_callbacks):
             try:
@@ -47,10 +106,13 @@ class File(object):
                 pass
 
     def __enter__(self):
+        if self.digest is not None:
+            return DigestWriter(self.__file, self.digest)
+
         return self.__file
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
+        self.close(commit=exc_type is None)
 
 
 class VersionField(p.CharField):
@@ -85,9 +147,47 @@ class Package(BaseModel):
     stable_version = VersionField(null=True)
     is_proxy = p.BooleanField(default=False, null=False)
 
+    # Bloom filter of the normalized names, None until loaded. The packages
+    # created by the other processes are seen after the periodic reload, so
+    # the misses of the filter are never cached.
+    NAMES = None
+    NAMES_CAPACITY = 100000
+    NAMES_INTERVAL = 60
+    NAMES_POOL = futures.ThreadPoolExecutor(1)
+    NAMES_RELOADER = None
+
     def __str__(self):
         return "%s" % self.name
 
+    @classmethod
+    def load_names(cls):
+        names = [package_tag(x.lower_name) for x in cls.select(cls.lower_name)]
+
+        bloom = BloomFilter(max(len(names) * 2, cls.NAMES_CAPACITY))
+        bloom.update(names)
+        cls.NAMES = bloom
+
+        log.info("Loaded %d package names", len(names))
+
+    @classmethod
+    def start_names_reload(cls):
+        def on_done(future):
+            exc = future.exception()
+            if exc is not None:
+                log.error("Loading package names failed")
+                log.exception(exc)
+
+        def reload():
+            cls.NAMES_POOL.submit(cls.load_names).add_done_callback(on_done)
+
+        if cls.NAMES_RELOADER is None:
+            cls.NAMES_RELOADER = PeriodicCallback(reload, cls.NAMES_INTERVAL * 1000)
+            cls.NAMES_RELOADER.start()
+
+    @classmethod
+    def maybe_exists(cls, name):
+        return cls.NAMES is None or package_tag(name) in cls.NAMES
+
     @timeit
     def hide_versions(self, releases):
         versions = dict(
@@ -97,6 +197,8 @@ class Package(BaseModel):
             )
         )
 
+        changed = False
+
         for version in releases:
             ver = versions.get(version, None)
             if not ver:
@@ -107,6 +209,10 @@ class Package(BaseModel):
             if ver.is_dirty():
                 log.debug("Set hidden flag for version %s of package %s as: %s", ver, self, ver.hidden)
                 ver.save()
+                changed = True
+
+        if changed:
+            Cache.bump(package_tag(self.name))
 
     @timeit
     def files(self, version=None):
@@ -186,19 +292,27 @@ class Package(BaseModel):
 
     @classmethod
     @timeit
-    @Cache(5)
+    @Cache(DAY, ignore_self=True, tag=package_tag, generational=True)
     def get_or_create(cls, name, proxy=False):
         if not Package.select().where(Package.name == name).count():
             pkg = Package(name=name, lower_name=name.lower(), is_proxy=proxy, owner=None)
             pkg.save()
+            Cache.bump(package_tag(name))
             return pkg
 
         return Package.get(name=name)
 
     @classmethod
-    @timeit
-    @Cache(5)
     def find(cls, name):
+        if not cls.maybe_exists(name):
+            raise LookupError('Package not found')
+
+        return cls.find_stored(name)
+
+    @classmethod
+    @timeit
+    @Cache(DAY, ignore_self=True, tag=package_tag, generational=True, negative_timeout=10 * MINUTE)
+    def find_stored(cls, name):
         q = Package.select().join(
             PackageVersion
         ).join(
@@ -301,14 +415,16 @@ class PackageVersion(BaseModel):
 
 class PackageFile(BaseModel):
     LOCK = RLock()
-    CHUNK_SIZE = 2 ** 16
 
     file = FileField(index=True, max_length=255)
     url = p.CharField(max_length=255, null=True, default=None)
     fetched = p.BooleanField(default=False, index=True)
     basename = p.CharField(max_length=255, index=True, unique=True)
     ts = p.DateTimeField(null=True)
+    accessed = p.DateTimeField(null=True, index=True)
     md5 = p.CharField(max_length=32, null=True)
+    sha256 = p.CharField(max_length=64, null=True)
+    metadata_sha256 = p.CharField(max_length=64, null=True)
     size = p.IntegerField(null=True)
     package = p.ForeignKeyField(Package, index=True)
     version = p.ForeignKeyField(PackageVersion, index=True)
@@ -331,21 +447,17 @@ class PackageFile(BaseModel):
 
         f = File(self.file, mode)
 
-        def metadata_update(f):
+        def metadata_update(_):
+            # Appended files are hashed from the beginning
+            digest = f.digest or Digest.from_file(self.file)
+
             stat = os.stat(self.file)
             self.ts = datetime.datetime.fromtimestamp(stat.st_mtime)
-            self.size = stat.st_size
-
-            md5 = hashlib.md5()
-            with open(self.file, 'rb') as fl:
-                data = fl.read(self.CHUNK_SIZE)
-                md5.update(data)
-                while data:
-                    data = fl.read(self.CHUNK_SIZE)
-                    md5.update(data)
-
-                    self.md5 = md5.hexdigest()
-
+            self.size = digest.size
+            self.md5 = digest.md5.hexdigest()
+            self.sha256 = digest.sha256.hexdigest()
+            self.deduplicate()
+            self.extract_metadata()
             self.save()
 
         if any(x in mode for x in 'wa'):
@@ -353,13 +465,88 @@ class PackageFile(BaseModel):
 
         return f
 
+    def adopt(self, path, digest):
+        # Moves a complete file of the same filesystem (e.g. an upload) into place
+        dirname = os.path.dirname(self.file)
+
+        with self.LOCK:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        os.rename(path, self.file)
+        fsync_dir(dirname)
+
+        self.ts = datetime.datetime.now()
+        self.size = digest.size
+        self.md5 = digest.md5.hexdigest()
+        self.sha256 = digest.sha256.hexdigest()
+        self.deduplicate()
+        self.extract_metadata()
+        self.save()
+
+    @property
+    def metadata_file(self):
+        return "%s.metadata" % self.file
+
+    def extract_metadata(self):
+        if not self.basename.endswith('.whl'):
+            return
+
+        try:
+            data = wheel_metadata(self.file)
+        except (zipfile.BadZipfile, IOError, OSError) as e:
+            log.warning('Reading metadata of "%s" failed: %r', self.basename, e)
+            return
+
+        if data is None:
+            log.warning('Wheel "%s" has no METADATA', self.basename)
+            return
+
+        f = File(self.metadata_file, 'wb')
+
+        with f as fl:
+            fl.write(data)
+
+        self.metadata_sha256 = f.digest.sha256.hexdigest()
+
+    def deduplicate(self):
+        if Blobs.enabled() and self.sha256:
+            Blobs.link(self.file, self.sha256)
+
     def __str__(self):
         return "%s" % self.basename
 
 
 def remove_file(f):
     log.info('Removing file "%s"', f.file)
-    os.remove(f.file)
+    paths = [f.file, f.metadata_file]
+
+    # The files of a download in progress are left to it
+    lock_path = "%s.lock" % f.file
+    lock = try_lock(lock_path) if os.path.isdir(os.path.dirname(f.file)) else None
+
+    if lock is not None:
+        paths += ["%s.part" % f.file, "%s.journal" % f.file]
+
+    try:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+    finally:
+        if lock is not None:
+            unlock(lock, lock_path)
+
+    if Blobs.enabled() and f.sha256:
+        Blobs.release(f.sha256)
 
 
 @signals.pre_delete(PackageFile)
@@ -376,3 +563,9 @@ def on_delete_file(model_class, instance):
 
     for f in files:
         io_loop.add_callback(remove_file, f)
+
+
+@signals.post_save(Package)
+def on_save_package(model_class, instance, created):
+    if created and Package.NAMES is not None:
+        Package.NAMES.add(package_tag(instance.lower_name))
@@ -0,0 +1,52 @@
+# encoding: utf-8
+import hashlib
+import io
+
+
+class Digest(object):
+    __slots__ = ('md5', 'sha256', 'size')
+
+    CHUNK_SIZE = 2 ** 16
+
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data):
+        self.md5.update(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    @classmethod
+    def from_file(cls, path):
+        digest = cls()
+
+        with io.open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest
+
+    def verify(self, md5=None, sha256=None):
+        for name, expected in (('md5', md5), ('sha256', sha256)):
+            actual = getattr(self, name).hexdigest()
+
+            if expected and actual != expected:
+                raise ValueError("%s mismatch: %s != %s" % (name.upper(), actual, expected))
+
+
+# Hashes the data on the way to the file, no second pass over it
+class DigestWriter(object):
+    __slots__ = ('file', 'digest')
+
+    def __init__(self, f, digest=None):
+        self.file = f
+        self.digest = digest or Digest()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
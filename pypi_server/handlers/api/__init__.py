@@ -88,3 +88,4 @@ import pypi_server.handlers.api.user
 import pypi_server.handlers.api.packages
 import pypi_server.handlers.api.package
 import pypi_server.handlers.api.version
+import pypi_server.handlers.api.cache
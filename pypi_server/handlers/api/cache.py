@@ -0,0 +1,19 @@
+# encoding: utf-8
+from pypi_server.cache import Cache
+from pypi_server.handlers import route
+from pypi_server.handlers.api import JSONHandler
+from pypi_server.handlers.api.login import authorization_required
+from pypi_server.handlers.base import threaded
+
+
+@route('/api/v1/cache/?')
+class CacheHandler(JSONHandler):
+    @authorization_required(is_admin=True)
+    @threaded
+    def get(self):
+        self.response(Cache.snapshot())
+
+    @authorization_required(is_admin=True)
+    def delete(self):
+        Cache.invalidate_all()
+        self.response({'invalidated': True})
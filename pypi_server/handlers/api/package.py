@@ -1,11 +1,12 @@
 # encoding: utf-8
-from pypi_server.cache import Cache
-from pypi_server.db.packages import Package, PackageVersion
+from pypi_server.cache import Cache, DAY
+from pypi_server.db.packages import Package, PackageVersion, package_tag
 from pypi_server.handlers import route
 from pypi_server.handlers.api import JSONHandler
 from pypi_server.handlers.api.login import authorization_required
 from pypi_server.handlers.base import threaded
 from pypi_server.handlers.pypi.proxy.client import normalize_package_name
+from pypi_server.handlers.pypi.simple import invalidate_package
 from tornado.gen import coroutine
 from tornado.web import HTTPError
 
@@ -41,7 +42,7 @@ class PackageHandler(JSONHandler):
 
     @staticmethod
     @threaded
-    @Cache(5)
+    @Cache(DAY, tag=package_tag, generational=True)
     def get_package(package):
         q = Package.select().where(
             Package.lower_name == package.lower() or Package.lower_name == normalize_package_name(package)
@@ -57,6 +58,9 @@ class PackageHandler(JSONHandler):
     def delete(self, package):
         pkg = yield self.get_package(package)
         yield self.thread_pool.submit(pkg.delete_instance, recursive=True)
+
+        invalidate_package(pkg.name)
+
         self.response({
             'package': pkg.lower_name,
             'deleted': True,
@@ -70,5 +74,6 @@ class PackageHandler(JSONHandler):
 
         if pkg.is_dirty():
             yield self.thread_pool.submit(pkg.save)
+            invalidate_package(pkg.name)
 
         self.response((yield self.package_info(pkg)))
@@ -8,6 +8,7 @@ from pypi_server.handlers.api import JSONHandler
 from pypi_server.handlers.api.login import authorization_required
 from pypi_server.handlers.base import threaded
 from pypi_server.handlers.pypi.proxy.client import normalize_package_name
+from pypi_server.handlers.pypi.simple import invalidate_package
 
 
 @route('/api/v1/package/(?P<package>[\w\.\d\-\_]+)/(?P<version>[\w\d\.]+)/?')
@@ -25,6 +26,7 @@ class PackageVersionHandler(JSONHandler):
 
         if ver.is_dirty:
             yield self.thread_pool.submit(ver.save)
+            invalidate_package(package)
 
         self.response((yield self.version_info(ver)))
 
@@ -33,6 +35,7 @@ class PackageVersionHandler(JSONHandler):
     def delete(self, package, version):
         ver = yield self.get_version(package, version)
         yield self.thread_pool.submit(ver.delete_instance, recursive=True)
+        invalidate_package(package)
 
     @staticmethod
     @threaded
@@ -0,0 +1,219 @@
+# encoding: utf-8
+import io
+import os
+import re
+import tempfile
+from tornado.httputil import HTTPHeaders, _parse_header
+from pypi_server.digest import DigestWriter
+
+
+class MultipartError(ValueError):
+    pass
+
+
+# The file parts go to a temporary file in the storage (a rename puts it
+# in place), nothing but the digests are kept in memory.
+class SpooledFile(object):
+    def __init__(self, dirname, filename, content_type):
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+
+        fd, self.path = tempfile.mkstemp(dir=dirname, suffix='.upload')
+        os.fchmod(fd, 0o644)
+
+        self.filename = filename
+        self.content_type = content_type
+        self.file = DigestWriter(io.open(fd, 'wb'))
+
+    @property
+    def digest(self):
+        return self.file.digest
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        # It's synced to the disk by the consumer, out of the IOLoop thread
+        self.file.close()
+
+    def remove(self):
+        self.file.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Field(object):
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+        if self.size > self.max_size:
+            raise MultipartError("Form field is too big")
+
+        self.chunks.append(data)
+
+    def close(self):
+        pass
+
+    @property
+    def value(self):
+        return b''.join(self.chunks)
+
+
+# Incremental multipart/form-data parser. Besides RFC 2046 bodies it takes
+# the ones of the old distutils/setuptools "upload" command, which uses
+# bare "\n" line endings.
+class MultipartParser(object):
+    PREAMBLE, BOUNDARY, HEADERS, BODY, DONE = range(5)
+
+    MAX_HEADERS_SIZE = 2 ** 16
+    MAX_FIELD_SIZE = 2 ** 22
+    MAX_FIELDS_SIZE = 2 ** 24
+
+    BLANK_LINE = re.compile(br"\r?\n\r?\n")
+
+    def __init__(self, boundary, spool):
+        self.boundary = b'--' + boundary
+        # A part ends with the line break before the boundary
+        self.delimiter = b'\n' + self.boundary
+        self.spool = spool
+
+        self.buffer = b''
+        self.state = self.PREAMBLE
+        self.part = None
+        self.fields = {}
+        self.files = {}
+        self.fields_size = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+        parsers = {
+            self.PREAMBLE: self._preamble,
+            self.BOUNDARY: self._boundary_end,
+            self.HEADERS: self._headers,
+            self.BODY: self._body,
+        }
+
+        while self.buffer and self.state != self.DONE:
+            if not parsers[self.state]():
+                break
+
+    def close(self):
+        if self.state != self.DONE:
+            raise MultipartError("Unexpected end of the form data")
+
+    def _boundary_end(self):
+        # The rest of the boundary line, "--" closes the body
+        end = self.buffer.find(b'\n')
+
+        if end < 0:
+            if self.buffer[:2] == b'--':
+                self.buffer = b''
+                self.state = self.DONE
+            elif len(self.buffer) > self.MAX_HEADERS_SIZE:
+                raise MultipartError("Malformed boundary line")
+            return False
+
+        tail = self.buffer[:end].strip()
+        self.buffer = self.buffer[end + 1:]
+        self.state = self.DONE if tail.startswith(b'--') else self.HEADERS
+        return True
+
+    def _preamble(self):
+        index = self.buffer.find(self.boundary)
+
+        if index < 0:
+            # Keep what may be the beginning of the boundary
+            self.buffer = self.buffer[-len(self.boundary):]
+            return False
+
+        self.buffer = self.buffer[index + len(self.boundary):]
+        self.state = self.BOUNDARY
+        return True
+
+    def _headers(self):
+        match = self.BLANK_LINE.search(self.buffer)
+
+        if match is None:
+            if len(self.buffer) > self.MAX_HEADERS_SIZE:
+                raise MultipartError("Part headers are too big")
+            return False
+
+        headers = HTTPHeaders()
+
+        for line in re.split(br"\r?\n", self.buffer[:match.start()]):
+            if line.strip():
+                headers.parse_line(line.decode('utf-8'))
+
+        self.buffer = self.buffer[match.end():]
+        self.start_part(headers)
+        self.state = self.BODY
+        return True
+
+    def _body(self):
+        index = self.buffer.find(self.delimiter)
+
+        if index < 0:
+            # The delimiter and the "\r" before it may be split between the chunks
+            keep = len(self.delimiter) + 1
+
+            if len(self.buffer) > keep:
+                self.part.write(self.buffer[:-keep])
+                self.buffer = self.buffer[-keep:]
+
+            return False
+
+        end = index - 1 if index and self.buffer[index - 1:index] == b'\r' else index
+        self.part.write(self.buffer[:end])
+        self.finish_part()
+
+        self.buffer = self.buffer[index + len(self.delimiter):]
+        self.state = self.BOUNDARY
+        return True
+
+    def start_part(self, headers):
+        disposition, params = _parse_header(headers.get('Content-Disposition', ''))
+
+        if disposition != 'form-data' or not params.get('name'):
+            raise MultipartError("Invalid multipart/form-data")
+
+        name = params['name']
+
+        if 'filename' in params:
+            self.part = self.spool(
+                os.path.basename(params['filename']),
+                headers.get('Content-Type', 'application/octet-stream')
+            )
+            self.files.setdefault(name, []).append(self.part)
+        else:
+            self.part = Field(min(self.MAX_FIELD_SIZE, self.MAX_FIELDS_SIZE - self.fields_size))
+            self.fields.setdefault(name, []).append(self.part)
+
+    def finish_part(self):
+        self.part.close()
+
+        if isinstance(self.part, Field):
+            self.fields_size += self.part.size
+
+        self.part = None
+
+    def arguments(self):
+        return dict(
+            (name, [field.value for field in fields])
+            for name, fields in self.fields.items()
+        )
+
+    def remove(self):
+        for files in self.files.values():
+            for f in files:
+                f.remove()
@@ -1,56 +1,171 @@
 # encoding: utf-8
 import base64
-import hashlib
 import logging
+import os
 import peewee
+from email.utils import mktime_tz, parsedate_tz
 from functools import wraps
+from time import mktime
 from peewee import DoesNotExist
-from pypi_server import PY2
+from pypi_server import PY2, http_range, sendfile
 from pypi_server.db import DB
 from pypi_server.handlers.pypi.proxy.client import PYPIClient
+from pypi_server.handlers.pypi.proxy.download import Download
 from six import b
 from tornado.gen import coroutine, Task, maybe_future, Return
-from tornado.web import asynchronous, HTTPError
-from tornado.httpclient import AsyncHTTPClient, HTTPError as HTTPClientError
+from tornado.options import options
+from tornado.web import asynchronous, stream_request_body, HTTPError
+from tornado.httpclient import HTTPError as HTTPClientError
+from tornado.escape import utf8
+from tornado.httputil import _parse_header, format_timestamp
 from pypi_server.handlers import route
 from pypi_server.handlers.base import BaseHandler, threaded
+from pypi_server.handlers.pypi.multipart import MultipartError, MultipartParser, SpooledFile
+from pypi_server.handlers.pypi.simple import invalidate_package
 from pypi_server.http_cache import HTTPCache
+from pypi_server.storage import Storage
 from pypi_server.cache import Cache, HOUR, MONTH
 from pypi_server.db.packages import Package, PackageVersion, PackageFile, HashVersion
 from pypi_server.db.users import Users
 
 
 if PY2:
-    from urllib import unquote_plus
+    from urllib import quote, unquote_plus
 else:
-    from urllib.parse import unquote_plus
+    from urllib.parse import quote, unquote_plus
 
 
 log = logging.getLogger(__name__)
 
 
-@threaded
-def write_file(pkg_file, data):
-    with pkg_file.open('wb+') as f:
-        f.write(data)
+# The core metadata files are served by MetadataHandler
+@route(r"/simple/(?P<package>\S+)/(?P<version>\S+)/(?P<filename>\S+)(?<!\.metadata)")
+@route(r"/package/(?P<package>\S+)/(?P<version>\S+)/(?P<filename>\S+)(?<!\.metadata)")
+class FileHandler(BaseHandler):
+    CHUNK_SIZE = 2 ** 16
+
+    @asynchronous
+    @HTTPCache(MONTH, use_expires=True, expire_timeout=MONTH, immutable=True)
+    @coroutine
+    def get(self, package, version, filename):
+        try:
+            pkg_file = yield self.get_file(package, version, filename)
+        except LookupError:
+            self.send_error(404)
+            return
 
-    pkg_file.fetched = True
+        self.set_file_headers(pkg_file)
+        Storage.touch(pkg_file)
 
-    assert hashlib.md5(data).hexdigest() == pkg_file.md5
+        if self.not_modified(pkg_file):
+            self.set_status(304)
+            self.finish()
+            return
 
-    pkg_file.save()
-    return pkg_file
+        if pkg_file.fetched and pkg_file.url and not pkg_file.exists():
+            # Evicted after the row was read
+            pkg_file.fetched = False
 
+        if not pkg_file.fetched:
+            download = self.fetch_remote_file(pkg_file)
 
-@route(r"/simple/(?P<package>\S+)/(?P<version>\S+)/(?P<filename>\S+)")
-@route(r"/package/(?P<package>\S+)/(?P<version>\S+)/(?P<filename>\S+)")
-class FileHandler(BaseHandler):
-    CHUNK_SIZE = 2 ** 16
+            if not (options.offload or self.request.headers.get("Range")):
+                # The client gets the chunks while the file is downloading
+                if pkg_file.size is not None:
+                    self.set_header("Content-Length", pkg_file.size)
+
+                try:
+                    yield download.stream(self)
+                except Exception as e:
+                    if not self._headers_written:
+                        raise
+
+                    # The response can't be completed, the client mustn't take it for the file
+                    log.warning('Streaming "%s" failed: %r', pkg_file.basename, e)
+                    self.request.connection.close()
+                    return
+
+                self.finish()
+                return
+
+            # The concurrent requests share the download and its row
+            pkg_file = yield download.wait()
+            self.set_file_headers(pkg_file)
+
+        if options.offload:
+            self.offload(pkg_file)
+            self.finish()
+            return
+
+        try:
+            ranges = self.get_ranges(pkg_file)
+        except http_range.RangeNotSatisfiable as e:
+            self.set_status(416)
+            self.set_header("Content-Range", str(e))
+            self.finish()
+            return
+
+        with pkg_file.open() as f:
+            if ranges is None:
+                self.set_header("Content-Length", pkg_file.size)
+                yield self.send_body(f, 0, pkg_file.size)
+
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                self.set_status(206)
+                self.set_header("Content-Range", http_range.content_range(start, end, pkg_file.size))
+                self.set_header("Content-Length", end - start + 1)
+                yield self.send_body(f, start, end - start + 1)
+
+            else:
+                multipart = http_range.Multipart(ranges, pkg_file.size)
+                self.set_status(206)
+                self.set_header("Content-Type", multipart.content_type)
+                self.set_header("Content-Length", len(multipart))
+
+                for header, start, end in multipart.parts():
+                    self.write(header)
+                    yield self.send_body(f, start, end - start + 1)
+
+                self.write(multipart.trailer)
+
+        self.finish()
 
     @asynchronous
-    @HTTPCache(MONTH, use_expires=True, expire_timeout=MONTH)
+    @HTTPCache(MONTH, use_expires=True, expire_timeout=MONTH, immutable=True)
     @coroutine
-    def get(self, package, version, filename):
+    def head(self, package, version, filename):
+        # Only the database row, the file isn't opened (or fetched)
+        try:
+            pkg_file = yield self.get_file(package, version, filename)
+        except LookupError:
+            self.send_error(404)
+            return
+
+        self.set_file_headers(pkg_file)
+
+        if self.not_modified(pkg_file):
+            self.set_status(304)
+            self.finish()
+            return
+
+        size = pkg_file.size
+
+        if size is None and pkg_file.fetched and pkg_file.exists():
+            # Stored before the sizes were recorded
+            size = yield self.thread_pool.submit(os.path.getsize, pkg_file.file)
+
+        if size is not None:
+            self.set_header("Content-Length", size)
+        else:
+            # The same as GET streams it, not the length of the empty body
+            self.set_header("Transfer-Encoding", "chunked")
+            yield self.flush()
+
+        self.finish()
+
+    @coroutine
+    def get_file(self, package, version, filename):
         try:
             package = yield PYPIClient.find_real_name(package)
         except (LookupError, HTTPClientError) as e:
@@ -59,34 +174,100 @@ class FileHandler(BaseHandler):
 
             package = yield self.thread_pool.submit(Package.find, package)
 
-        try:
-            pkg_file = yield self.find_file(package, version, filename)
-            if not pkg_file.fetched:
-                yield self.fetch_remote_file(pkg_file)
-        except LookupError:
-            self.send_error(404)
-        else:
+        raise Return((yield self.find_file(package, version, filename)))
+
+    def compute_etag(self):
+        # The ETag is the md5 of the file, if it's known
+        return None
+
+    def set_file_headers(self, pkg_file):
+        self.set_header("Content-Type", 'application/octet-stream')
+        self.set_header("Accept-Ranges", "bytes")
+
+        if pkg_file.md5:
             self.set_header("MD5", pkg_file.md5)
-            self.set_header("ETag", pkg_file.md5)
-            self.set_header("Content-Length", pkg_file.size)
-            self.set_header("Content-Type", 'application/octet-stream')
-            self.set_header("Date", pkg_file.ts.strftime("%a, %d %b %Y %H:%M:%S %Z"))
+            self.set_header("ETag", '"%s"' % pkg_file.md5)
 
-            with pkg_file.open() as f:
-                reader = threaded(f.read)
+        if pkg_file.ts:
+            # PackageFile.ts is a local time
+            self.set_header("Last-Modified", format_timestamp(mktime(pkg_file.ts.timetuple())))
 
-                data = yield reader(self.CHUNK_SIZE)
-                self.write(data)
-                yield Task(self.flush)
+    def not_modified(self, pkg_file):
+        if_none_match = self.request.headers.get("If-None-Match")
 
-                for chunk in iter(lambda: reader(self.CHUNK_SIZE), None):
-                    data = yield chunk
-                    if not data:
-                        break
-                    self.write(data)
-                    yield Task(self.flush)
+        if if_none_match is not None:
+            if not pkg_file.md5:
+                return False
 
-            self.finish()
+            for etag in if_none_match.split(','):
+                etag = etag.strip()
+
+                if etag.startswith('W/'):
+                    etag = etag[2:]
+
+                if etag == '*' or etag.strip('"') == pkg_file.md5:
+                    return True
+
+            return False
+
+        if_modified_since = parsedate_tz(self.request.headers.get("If-Modified-Since", ""))
+
+        if if_modified_since is None or not pkg_file.ts:
+            return False
+
+        return int(mktime(pkg_file.ts.timetuple())) <= mktime_tz(if_modified_since)
+
+    def get_ranges(self, pkg_file):
+        header = self.request.headers.get("Range")
+
+        if not header:
+            return None
+
+        # The client has a part of another file, it needs the whole new one
+        if_range = self.request.headers.get("If-Range")
+        if if_range is not None and if_range.strip('"') != pkg_file.md5:
+            return None
+
+        return http_range.parse(header, pkg_file.size)
+
+    @coroutine
+    def send_body(self, f, offset, count):
+        connection = self.request.connection
+        stream = getattr(connection, "stream", None)
+
+        if options.sendfile and sendfile.supported(stream):
+            # Headers (and buffered data) go first, the body is written by the kernel
+            yield self.flush()
+            yield sendfile.sendfile(stream, f, offset, count)
+
+            # Bypassed the connection, so it can't count the body
+            if getattr(connection, '_expected_content_remaining', None) is not None:
+                connection._expected_content_remaining -= count
+
+            return
+
+        f.seek(offset)
+        reader = threaded(f.read)
+
+        while count > 0:
+            data = yield reader(min(self.CHUNK_SIZE, count))
+
+            if not data:
+                raise IOError("Unexpected end of file %r" % f.name)
+
+            count -= len(data)
+            self.write(data)
+            yield Task(self.flush)
+
+    def offload(self, pkg_file):
+        # The fronting server sends the file itself
+        if options.offload == 'nginx':
+            path = os.path.relpath(pkg_file.file, PackageFile.file.STORAGE)
+            self.set_header("X-Accel-Redirect", options.offload_prefix.rstrip('/') + '/' + quote(path))
+        elif options.offload == 'apache':
+            self.set_header("X-Sendfile", pkg_file.file)
+        else:
+            raise ValueError("Unknown offload mode %r" % options.offload)
 
     @threaded
     def find_file(self, package, version, filename):
@@ -111,10 +292,83 @@ class FileHandler(BaseHandler):
         return PackageFile.get(id=pkg_file[0].id)
 
     @classmethod
-    @coroutine
     def fetch_remote_file(cls, pkg_file):
-        response = yield AsyncHTTPClient().fetch(pkg_file.url)
-        yield write_file(pkg_file, response.body)
+        return Download.get(pkg_file)
+
+
+# PEP 658 core metadata of the wheels, extracted when the wheel is stored
+@route(r"/simple/(?P<package>\S+)/(?P<version>\S+)/(?P<filename>\S+)\.metadata")
+@route(r"/package/(?P<package>\S+)/(?P<version>\S+)/(?P<filename>\S+)\.metadata")
+class MetadataHandler(FileHandler):
+    @HTTPCache(MONTH, use_expires=True, expire_timeout=MONTH, immutable=True)
+    @coroutine
+    def get(self, package, version, filename):
+        pkg_file = yield self.get_metadata(package, version, filename)
+
+        if self.set_metadata_headers(pkg_file):
+            return
+
+        with open(pkg_file.metadata_file, 'rb') as f:
+            self.finish(f.read())
+
+    @HTTPCache(MONTH, use_expires=True, expire_timeout=MONTH, immutable=True)
+    @coroutine
+    def head(self, package, version, filename):
+        pkg_file = yield self.get_metadata(package, version, filename)
+
+        if not self.set_metadata_headers(pkg_file):
+            self.set_header("Content-Length", os.path.getsize(pkg_file.metadata_file))
+            self.finish()
+
+    @coroutine
+    def get_metadata(self, package, version, filename):
+        if not filename.endswith('.whl'):
+            raise HTTPError(404)
+
+        try:
+            pkg_file = yield self.get_file(package, version, filename)
+        except LookupError:
+            raise HTTPError(404)
+
+        if pkg_file.metadata_sha256 and os.path.exists(pkg_file.metadata_file):
+            # Kept when the wheel itself is evicted
+            raise Return(pkg_file)
+
+        if not pkg_file.fetched or not pkg_file.exists():
+            if not pkg_file.url:
+                # An uploaded file which is gone, there's no upstream
+                raise HTTPError(404)
+
+            # Extracted when the download is stored
+            pkg_file = yield self.fetch_remote_file(pkg_file).wait()
+
+        if not pkg_file.metadata_sha256 or not os.path.exists(pkg_file.metadata_file):
+            # Wheels stored before the metadata extraction
+            yield self.extract_metadata(pkg_file)
+
+        if not pkg_file.metadata_sha256:
+            raise HTTPError(404)
+
+        raise Return(pkg_file)
+
+    @threaded
+    def extract_metadata(self, pkg_file):
+        pkg_file.extract_metadata()
+
+        if pkg_file.metadata_sha256:
+            pkg_file.save()
+            invalidate_package(pkg_file.package.name)
+
+    def set_metadata_headers(self, pkg_file):
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.set_header("ETag", '"%s"' % pkg_file.metadata_sha256)
+
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return True
+
+        return False
 
 
 @threaded
@@ -127,6 +381,15 @@ def check_password(login, password):
     return user
 
 
+def basic_credentials(auth_header):
+    auth_type, data = auth_header.split()
+    if auth_type.lower() != 'basic':
+        raise ValueError("Unsupported authorization type")
+
+    username, password = map(lambda x: unquote_plus(x.decode("utf-8")), base64.b64decode(b(data)).split(b(":")))
+    return username, password
+
+
 def authorization_required(func):
     @wraps(func)
     @coroutine
@@ -137,15 +400,17 @@ def authorization_required(func):
             self.set_status(401)
             raise Return(self.finish("Authorization required"))
 
-        auth_type, data = auth_header.split()
-        if auth_type.lower() != 'basic':
-            raise Return(self.send_error(400))
+        # Checked already by the handler, before the body was received
+        if self.current_user is None:
+            try:
+                username, password = basic_credentials(auth_header)
+            except (ValueError, TypeError):
+                raise Return(self.send_error(400))
 
-        username, password = map(lambda x: unquote_plus(x.decode("utf-8")), base64.b64decode(b(data)).split(b(":")))
-        try:
-            self.current_user = yield check_password(username, password)
-        except LookupError:
-            raise HTTPError(403)
+            try:
+                self.current_user = yield check_password(username, password)
+            except LookupError:
+                raise HTTPError(403)
 
         result = yield maybe_future(func(self, *args, **kwargs))
         raise Return(result)
@@ -154,7 +419,15 @@ def authorization_required(func):
 
 
 @route(r"/pypi/?")
+@stream_request_body
 class XmlRPC(BaseHandler):
+    # Uploads of the authorized users
+    MAX_BODY_SIZE = 2 ** 34
+    SPOOL_DIR = '.uploads'
+
+    form = None
+    form_error = None
+
     METADATA_KEYS = {
         u"name",
         u"version",
@@ -184,52 +457,89 @@ class XmlRPC(BaseHandler):
 
     @coroutine
     def prepare(self):
-        if self.request.method.upper() == 'POST' and not self.request.body.startswith(b("\r\n")):
-            boundary = dict(
-                filter(
-                    lambda x: x[0] == 'boundary',
-                    map(
-                        lambda x: x.strip().split("="),
-                        self.request.headers.get('Content-Type', '').split(';')
-                    )
-                )
-            ).get('boundary')
-
-            if not boundary:
-                raise HTTPError(400)
-
-            def normalize(chunk):
-                if b('\n\n') not in chunk:
-                    return b('\r\n') + chunk[1:]
-
-                ret = b('')
-                ret += b('\r\n')
-                data, content = chunk.split(b('\n\n'), 1)
-                ret += data[1:]
-                ret += b('\r\n\r\n')
-                ret += content[:-1]
-                ret += b('\r\n')
-                return ret
-
-            boundary = b("--{0}".format(boundary))
-
-            new_body = boundary.join(
-                map(
-                    normalize,
-                    self.request.body.split(boundary)
-                )
-            )
+        self.chunks = []
 
-            new_body = new_body[:-4]
-            new_body += b('--\r\n')
+        if self.request.method.upper() == 'POST':
+            # Only the authorized users get the upload body size limit, the
+            # credentials are checked before anything is spooled.
+            auth_header = self.request.headers.get('Authorization')
 
-            self.request.body = new_body
-            self.request._parse_body()
+            if auth_header:
+                try:
+                    username, password = basic_credentials(auth_header)
+                except (ValueError, TypeError):
+                    raise HTTPError(400)
+
+                try:
+                    self.current_user = yield check_password(username, password)
+                except LookupError:
+                    raise HTTPError(403)
+
+                self.request.connection.set_max_body_size(self.MAX_BODY_SIZE)
+
+            content_type, params = _parse_header(self.request.headers.get('Content-Type', ''))
+
+            if content_type == 'multipart/form-data':
+                if not params.get('boundary'):
+                    raise HTTPError(400)
+
+                self.form = MultipartParser(utf8(params['boundary']), self.spool)
 
         yield maybe_future(super(XmlRPC, self).prepare())
 
+    def spool(self, filename, content_type):
+        return SpooledFile(os.path.join(PackageFile.file.STORAGE, self.SPOOL_DIR), filename, content_type)
+
+    def data_received(self, chunk):
+        if self._finished:
+            return
+
+        if self.form is None:
+            self.chunks.append(chunk)
+            return
+
+        if self.form_error is not None:
+            return
+
+        try:
+            self.form.feed(chunk)
+        except MultipartError as e:
+            self.form_error = e
+
+    def parse_body(self):
+        if self.form is None:
+            self.request.body = b('').join(self.chunks)
+            self.chunks = []
+            self.request._parse_body()
+            return
+
+        try:
+            if self.form_error is not None:
+                raise self.form_error
+
+            self.form.close()
+        except MultipartError as e:
+            log.warning("Bad upload form: %s", e)
+            raise HTTPError(400)
+
+        for name, values in self.form.arguments().items():
+            self.request.body_arguments.setdefault(name, []).extend(values)
+            self.request.arguments.setdefault(name, []).extend(values)
+
+        self.request.files = self.form.files
+
+    def on_finish(self):
+        # The spooled files which weren't stored
+        if self.form is not None:
+            self.form.remove()
+
+    def on_connection_close(self):
+        self.on_finish()
+
     @coroutine
     def post(self):
+        self.parse_body()
+
         try:
             action = self.get_body_argument(':action')
             self.request.body_arguments.pop(':action')
@@ -271,6 +581,8 @@ class XmlRPC(BaseHandler):
         pkg = Package(name=name, lower_name=name.lower(), owner=self.current_user)
         pkg.save()
 
+        invalidate_package(name)
+
     def action_verify(self):
         pass
 
@@ -291,7 +603,13 @@ class XmlRPC(BaseHandler):
             version = package.create_version(self.get_body_argument('version'))
 
             uploaded_file = self.request.files['content'][0]
-            if not str(hashlib.md5(uploaded_file.body).hexdigest()) == str(self.get_body_argument('md5_digest')):
+
+            try:
+                uploaded_file.digest.verify(
+                    md5=self.get_body_argument('md5_digest'),
+                    sha256=self.get_body_argument('sha256_digest', None),
+                )
+            except ValueError:
                 raise HTTPError(406)
 
             list_values = (u'classifiers', u'keywords')
@@ -307,14 +625,13 @@ class XmlRPC(BaseHandler):
             try:
                 pkg_file = version.create_file(uploaded_file.filename)
                 pkg_file.fetched = True
-                pkg_file.md5 = str(self.get_body_argument('md5_digest'))
 
                 if pkg_file.exists():
                     raise HTTPError(409)
 
-                with pkg_file.open("wb+") as f:
-                    f.write(uploaded_file.body)
-
-                pkg_file.save()
+                # Hashed while spooled, so the file is just renamed into place
+                pkg_file.adopt(uploaded_file.path, uploaded_file.digest)
             except peewee.DataError:
                 raise HTTPError(409)
+
+        invalidate_package(package_name)
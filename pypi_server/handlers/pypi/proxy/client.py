@@ -9,17 +9,14 @@ from tornado.ioloop import IOLoop
 from tornado.locks import Lock
 from tornado.options import options
 from tornado_xmlrpc.client import ServerProxy
-from pypi_server.cache import Cache, HOUR, MONTH
+from pypi_server import normalize_package_name
+from pypi_server.cache import Cache, MINUTE, HOUR, DAY, MONTH
 from pypi_server.hash_version import HashVersion
 
 
 log = logging.getLogger(__name__)
 
 
-def normalize_package_name(name):
-    return name.lower().replace("_", "-").replace(".", "-")
-
-
 class PYPIClient(object):
     CLIENT = None
     BACKEND = None
@@ -40,7 +37,7 @@ class PYPIClient(object):
 
     @classmethod
     @coroutine
-    @Cache(HOUR, files_cache=True, ignore_self=True)
+    @Cache(HOUR, files_cache=True, ignore_self=True, hard_timeout=DAY)
     def packages(cls):
         with (yield cls.LOCK.acquire()):
             index = dict(
@@ -93,7 +90,7 @@ class PYPIClient(object):
 
     @classmethod
     @coroutine
-    @Cache(4 * HOUR, files_cache=True, ignore_self=True)
+    @Cache(4 * HOUR, files_cache=True, ignore_self=True, hard_timeout=DAY, negative_timeout=10 * MINUTE)
     def releases(cls, name):
         process_versions = lambda x: set(HashVersion(i) for i in x)
 
@@ -141,6 +138,7 @@ class PYPIClient(object):
                 files = [{
                     'filename': filename,
                     'md5_digest': hashlib.md5(response.body).hexdigest(),
+                    'digests': {'sha256': hashlib.sha256(response.body).hexdigest()},
                     'downloads': -1,
                     'url': download_url,
                     'size': len(response.body),
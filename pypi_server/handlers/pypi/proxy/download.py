@@ -0,0 +1,358 @@
+# encoding: utf-8
+import datetime
+import errno
+import io
+import json
+import logging
+import os
+from datetime import timedelta
+from tornado.gen import coroutine, sleep, Return
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+from pypi_server.cache import Cache
+from pypi_server.db.packages import fsync_dir, package_tag
+from pypi_server.digest import Digest
+from pypi_server.handlers.base import threaded
+from pypi_server.locks import try_lock, unlock
+
+
+log = logging.getLogger(__name__)
+
+
+class Download(object):
+    CHUNK_SIZE = 2 ** 16
+    CONNECT_TIMEOUT = 30
+    REQUEST_TIMEOUT = 3600
+    # The body isn't kept in memory, the limit of the shared client doesn't matter
+    MAX_BODY_SIZE = 2 ** 40
+    POLL_INTERVAL = 0.1
+    CLIENT = None
+    # file path -> download in progress
+    ACTIVE = {}
+
+    def __init__(self, pkg_file):
+        self.pkg_file = pkg_file
+        self.path = pkg_file.file
+        self.part = "%s.part" % pkg_file.file
+        self.lock_path = "%s.lock" % pkg_file.file
+        # The upstream validators of the part file, a retry resumes it
+        self.journal_path = "%s.journal" % pkg_file.file
+        self.journal = {}
+        self.status = None
+        self.headers = None
+        self.skip = False
+        self.digest = Digest()
+        self.size = 0
+        # Counts the restarts of the part file from the beginning
+        self.restarts = 0
+        self.done = False
+        self.error = None
+        self.condition = Condition()
+        self.future = None
+        self.file = None
+
+    @classmethod
+    def client(cls):
+        if cls.CLIENT is None or cls.CLIENT.io_loop is not IOLoop.current():
+            cls.CLIENT = AsyncHTTPClient(force_instance=True, max_body_size=cls.MAX_BODY_SIZE)
+
+        return cls.CLIENT
+
+    @classmethod
+    def get(cls, pkg_file):
+        download = cls.ACTIVE.get(pkg_file.file)
+
+        if download is None:
+            download = cls.ACTIVE[pkg_file.file] = cls(pkg_file)
+            download.start()
+
+        return download
+
+    def start(self):
+        self.future = self._download()
+        IOLoop.current().add_future(self.future, self._on_done)
+        return self
+
+    def _on_done(self, future):
+        if self.ACTIVE.get(self.path) is self:
+            del self.ACTIVE[self.path]
+
+        # Failures are logged already, the readers get the error anyway
+        future.exception()
+
+    @coroutine
+    def wait(self):
+        yield self.future
+        raise Return(self.pkg_file)
+
+    def _on_chunk(self, chunk):
+        if self.skip:
+            return
+
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.size = self.digest.size
+        self.condition.notify_all()
+
+    @coroutine
+    def _download(self):
+        lock = None
+
+        try:
+            dirname = os.path.dirname(self.path)
+
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+            # Worker processes sharing the storage download a file once
+            while True:
+                lock = try_lock(self.lock_path)
+
+                if lock is not None:
+                    break
+
+                self.follow()
+                yield sleep(self.POLL_INTERVAL)
+
+            if os.path.exists(self.path):
+                log.info('File "%s" was downloaded by another process', self.pkg_file.basename)
+                self.size = os.path.getsize(self.path)
+                yield self.reload()
+            else:
+                yield self.fetch()
+        except Exception as e:
+            log.error('Downloading "%s" failed: %r', self.pkg_file.basename, e)
+            self.error = e
+            raise
+        finally:
+            if lock is not None:
+                unlock(lock, self.lock_path)
+
+            self.done = True
+            self.condition.notify_all()
+
+    def follow(self):
+        try:
+            size = os.stat(self.part).st_size
+        except OSError:
+            return
+
+        if size < self.size:
+            # Restarted by the other process
+            self.restarts += 1
+
+        if size != self.size:
+            self.size = size
+            self.condition.notify_all()
+
+    @coroutine
+    def fetch(self):
+        yield self.resume()
+        self.condition.notify_all()
+
+        if self.size:
+            log.info('Resuming "%s" from %s at %d', self.pkg_file.basename, self.pkg_file.url, self.size)
+        else:
+            log.info('Downloading "%s" from %s', self.pkg_file.basename, self.pkg_file.url)
+
+        try:
+            # Unbuffered, the readers see every written chunk
+            self.file = io.open(self.part, 'ab', buffering=0)
+
+            try:
+                yield self.request()
+            except HTTPError as e:
+                if e.code != 416 or not self.size:
+                    raise
+
+                # The part doesn't match the upstream file anymore
+                self.reset()
+                yield self.request()
+
+            if self.skip:
+                self.discard()
+                raise IOError("Unexpected Content-Range of %s: %s" % (
+                    self.pkg_file.url, self.headers.get('Content-Range')
+                ))
+
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+            try:
+                self.digest.verify(md5=self.pkg_file.md5, sha256=self.pkg_file.sha256)
+            except ValueError as e:
+                self.discard()
+                raise IOError("%s of %s" % (e, self.pkg_file.url))
+
+            yield self.commit()
+        except Exception:
+            if self.file is not None:
+                self.file.close()
+
+            raise
+
+    def request(self):
+        headers = {}
+
+        if self.size:
+            headers['Range'] = 'bytes=%d-' % self.size
+            validator = self.journal.get('etag') or self.journal.get('last_modified')
+
+            if validator and not validator.startswith('W/'):
+                headers['If-Range'] = validator
+
+        self.status = None
+        self.headers = HTTPHeaders()
+        self.skip = False
+
+        return self.client().fetch(HTTPRequest(
+            self.pkg_file.url,
+            headers=headers,
+            header_callback=self._on_header,
+            streaming_callback=self._on_chunk,
+            connect_timeout=self.CONNECT_TIMEOUT,
+            request_timeout=self.REQUEST_TIMEOUT,
+        ))
+
+    def _on_header(self, line):
+        if line.startswith('HTTP/'):
+            self.status = int(line.split(' ', 2)[1])
+            # The body of an error response isn't a part of the file
+            self.skip = self.status >= 300
+        elif line.strip():
+            self.headers.parse_line(line)
+        elif not self.skip:
+            self._on_headers()
+
+    def _on_headers(self):
+        if self.status == 206:
+            if not self.headers.get('Content-Range', '').startswith('bytes %d-' % self.size):
+                self.skip = True
+                return
+        elif self.size:
+            # The upstream sent the whole file
+            self.reset()
+
+        self.journal = {
+            'url': self.pkg_file.url,
+            'etag': self.headers.get('ETag'),
+            'last_modified': self.headers.get('Last-Modified'),
+        }
+
+        with io.open(self.journal_path, 'w') as f:
+            f.write(json.dumps(self.journal, sort_keys=True))
+
+    def reset(self):
+        self.file.truncate(0)
+        self.digest = Digest()
+        self.size = 0
+        # The readers which got the old data can't go on
+        self.restarts += 1
+        self.condition.notify_all()
+
+    def discard(self):
+        for path in (self.part, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @threaded
+    def resume(self):
+        journal = {}
+
+        try:
+            with io.open(self.journal_path) as f:
+                journal = json.loads(f.read())
+        except (IOError, OSError, ValueError):
+            pass
+
+        if not os.path.exists(self.part):
+            return
+
+        if journal.get('url') != self.pkg_file.url:
+            # Nothing to check the part against
+            self.discard()
+            return
+
+        self.journal = journal
+        self.digest = Digest.from_file(self.part)
+        self.size = self.digest.size
+
+    @threaded
+    def reload(self):
+        # The hashes and the metadata are stored by the other process
+        self.pkg_file = type(self.pkg_file).get(id=self.pkg_file.id)
+
+    @threaded
+    def commit(self):
+        os.rename(self.part, self.path)
+        fsync_dir(os.path.dirname(self.path))
+        os.remove(self.journal_path)
+
+        self.pkg_file.fetched = True
+        self.pkg_file.md5 = self.digest.md5.hexdigest()
+        self.pkg_file.sha256 = self.digest.sha256.hexdigest()
+        self.pkg_file.size = self.size
+        self.pkg_file.ts = datetime.datetime.now()
+        self.pkg_file.deduplicate()
+        self.pkg_file.extract_metadata()
+        self.pkg_file.save()
+
+        # The index pages advertise the hashes and the metadata of the stored files
+        Cache.bump(package_tag(self.pkg_file.package.name))
+
+    def open(self):
+        # The part file is renamed after the download, the opened one is still readable
+        for path in (self.part, self.path):
+            try:
+                return io.open(path, 'rb')
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+        return None
+
+    @coroutine
+    def stream(self, handler):
+        offset = 0
+        restarts = self.restarts
+        f = None
+
+        try:
+            while True:
+                if restarts != self.restarts:
+                    if offset:
+                        raise IOError('Download of "%s" was restarted' % self.pkg_file.basename)
+
+                    restarts = self.restarts
+
+                if self.error is not None:
+                    raise self.error
+
+                if f is None and self.size:
+                    f = self.open()
+
+                # The last byte is held back until the file is verified, so the
+                # client never gets the complete body of a corrupted file.
+                available = self.size if self.done else self.size - 1
+
+                if f is not None and offset < available:
+                    # Just written, so it's read from the page cache
+                    data = f.read(min(self.CHUNK_SIZE, available - offset))
+
+                    if not data:
+                        # The file was replaced under the reader
+                        raise IOError('File "%s" was truncated' % self.pkg_file.basename)
+
+                    offset += len(data)
+
+                    handler.write(data)
+                    yield handler.flush()
+                elif self.done:
+                    break
+                else:
+                    yield self.condition.wait(timedelta(seconds=self.POLL_INTERVAL))
+        finally:
+            if f is not None:
+                f.close()
@@ -1,3 +1,10 @@
 # encoding: utf-8
 from pypi_server.handlers.pypi.simple.packages import PackagesHandler
-from pypi_server.handlers.pypi.simple.files import VersionsHandler
+from pypi_server.handlers.pypi.simple.files import VersionsHandler, proxy_remote_package
+from pypi_server.cache import Cache
+from pypi_server.db.packages import package_tag
+
+
+def invalidate_package(name):
+    Cache.bump(package_tag(name))
+    Cache.invalidate(proxy_remote_package, name)
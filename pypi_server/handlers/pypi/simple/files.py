@@ -1,8 +1,11 @@
 # encoding: utf-8
 import os
+import json
 import logging
+from datetime import datetime
+from time import mktime
 
-from pypi_server.cache import Cache, HOUR
+from pypi_server.cache import Cache, HOUR, DAY
 from pypi_server.timeit import timeit
 from tornado.gen import coroutine, Return
 from tornado.ioloop import IOLoop
@@ -11,7 +14,8 @@ from tornado.httpclient import HTTPError as HTTPClientError
 from pypi_server.handlers import route, add_slash
 from pypi_server.handlers.base import BaseHandler, threaded
 from pypi_server.handlers.pypi.proxy.client import PYPIClient
-from pypi_server.db.packages import PackageVersion, Package, PackageFile
+from pypi_server.handlers.pypi.simple.page import API_VERSION, HTML, JSON_V1, Page, negotiate
+from pypi_server.db.packages import PackageVersion, Package, PackageFile, package_tag
 
 
 log = logging.getLogger(__name__)
@@ -55,9 +59,9 @@ def chunks(lst, n):
 
 @coroutine
 @timeit
-@Cache(3600, files_cache=True)
+@Cache(HOUR, files_cache=True, hard_timeout=DAY, tag=package_tag)
 def proxy_remote_package(package):
-    pkg = yield threaded(Package.get_or_create)(name=package, proxy=True)
+    pkg = yield threaded(Package.get_or_create)(package, proxy=True)
 
     releases, cached_releases = yield [PYPIClient.releases(pkg.name), threaded(pkg.versions)(True)]
     IOLoop.current().add_callback(threaded(pkg.hide_versions), filter(lambda x: not x.hidden, releases))
@@ -92,8 +96,11 @@ def release_db_save(package, rel, version_info, release_files):
         pkg_file.fetched = False
         pkg_file.url = f['url']
         pkg_file.md5 = f['md5_digest']
+        pkg_file.sha256 = (f.get('digests') or {}).get('sha256')
+        pkg_file.size = f.get('size')
         pkg_file.save()
 
+    Cache.bump(package_tag(package.name))
     return version
 
 
@@ -104,6 +111,35 @@ def release_fetch(package, rel):
     raise Return((yield release_db_save(package, rel, version_info, release_files)))
 
 
+def file_json(pkg, pkg_file):
+    version = pkg_file.version
+    result = {
+        "filename": pkg_file.basename,
+        "url": "/simple/%s/%s/%s" % (pkg.lower_name, version.version, pkg_file.basename),
+        "hashes": dict(
+            (name, getattr(pkg_file, name)) for name in ('sha256', 'md5') if getattr(pkg_file, name)
+        ),
+        "yanked": False,
+    }
+
+    if pkg_file.size is not None:
+        result["size"] = pkg_file.size
+
+    if pkg_file.metadata_sha256:
+        # PEP 714 renamed the key, older clients know the PEP 658 one
+        result["core-metadata"] = result["dist-info-metadata"] = {"sha256": pkg_file.metadata_sha256}
+
+    if version.requires_python and version.requires_python != 'UNKNOWN':
+        result["requires-python"] = version.requires_python
+
+    if pkg_file.ts:
+        result["upload-time"] = datetime.utcfromtimestamp(mktime(pkg_file.ts.timetuple())).strftime(
+            "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+
+    return result
+
+
 @route(r'/simple/(?P<package>[\w\.\d\-\_]+)/?')
 @route(r'/simple/(?P<package>[\w\.\d\-\_]+)/(?P<version>[\w\.\d\-\_]+)/?')
 @add_slash
@@ -111,6 +147,22 @@ class VersionsHandler(BaseHandler):
     @timeit
     @coroutine
     def get(self, package, version=None):
+        content_type = negotiate(self)
+
+        try:
+            page = yield self.page(package, version, content_type)
+        except LookupError:
+            raise HTTPError(404)
+
+        if page.proxy:
+            # The sync bumps the package generation if anything is new upstream
+            IOLoop.current().add_callback(self.refresh, package)
+
+        page.send(self)
+
+    @coroutine
+    @Cache(DAY, ignore_self=True, tag=package_tag, generational=True)
+    def page(self, package, version=None, content_type=HTML):
         exists, is_proxy, pkg = yield self.packages_list(package)
 
         if not exists or (is_proxy or not pkg):
@@ -120,23 +172,62 @@ class VersionsHandler(BaseHandler):
                 pkg = None
 
         if not pkg:
-            raise HTTPError(404)
+            raise LookupError("Package not found")
 
         files = yield threaded(pkg.files)(version=version)
 
         if not files:
-            raise HTTPError(404)
+            raise LookupError("Files not found")
 
-        self.render(
-            os.path.join('simple', 'files.html'),
-            package=pkg.lower_name,
-            files=files
-        )
+        if content_type == JSON_V1:
+            body = json.dumps(self.project_json(pkg, files), sort_keys=True)
+        else:
+            body = self.render_string(
+                os.path.join('simple', 'files.html'),
+                package=pkg.lower_name,
+                files=files
+            )
+
+        raise Return(Page(body, content_type, proxy=bool(is_proxy or pkg.is_proxy)))
+
+    @staticmethod
+    def project_json(pkg, files):
+        versions = []
+
+        for pkg_file in files:
+            version = str(pkg_file.version.version)
+
+            if version not in versions:
+                versions.append(version)
+
+        return {
+            "meta": {"api-version": API_VERSION},
+            "name": package_tag(pkg.name),
+            "versions": versions,
+            "files": [file_json(pkg, pkg_file) for pkg_file in files],
+        }
+
+    @classmethod
+    @coroutine
+    def refresh(cls, package):
+        try:
+            yield cls.proxy_package(package)
+        except Exception as e:
+            log.warning("Updating proxied package %s failed: %r", package, e)
 
     @classmethod
     @threaded
-    @timeit
     def packages_list(cls, package):
+        # A miss of the names filter isn't cached, it's reloaded periodically
+        if not Package.maybe_exists(package):
+            return 0, 0, None
+
+        return cls.stored_packages_list(package)
+
+    @classmethod
+    @timeit
+    @Cache(DAY, ignore_self=True, tag=package_tag, generational=True)
+    def stored_packages_list(cls, package):
         q = Package.select().join(
             PackageVersion
         ).join(
@@ -1,12 +1,14 @@
 # encoding: utf-8
 import os
+import json
 from pypi_server.cache import Cache, DAY
 from tornado.gen import coroutine, Return
 from tornado_xmlrpc.handler import XMLRPCHandler
 from pypi_server.handlers import route, add_slash
 from pypi_server.handlers.base import BaseHandler, threaded
 from pypi_server.handlers.pypi.proxy.client import PYPIClient
-from pypi_server.db.packages import Package, PackageVersion, PackageFile
+from pypi_server.handlers.pypi.simple.page import API_VERSION, HTML, JSON_V1, Page, negotiate
+from pypi_server.db.packages import Package, PackageVersion, PackageFile, package_tag
 
 
 @route(r'/simple/?')
@@ -14,27 +16,43 @@ from pypi_server.db.packages import Package, PackageVersion, PackageFile
 class PackagesHandler(BaseHandler, XMLRPCHandler):
     @coroutine
     def get(self):
-        self.render(
-            os.path.join('simple', 'packages.html'),
-            packages=(yield self.pkg_list())
-        )
+        page = yield self.page(negotiate(self))
+        page.send(self)
+
+    @coroutine
+    @Cache(DAY, ignore_self=True, generational=True)
+    def page(self, content_type=HTML):
+        packages = yield self.pkg_list()
+
+        if content_type == JSON_V1:
+            body = json.dumps({
+                "meta": {"api-version": API_VERSION},
+                "projects": [{"name": pkg.name} for pkg in packages],
+            })
+        else:
+            body = self.render_string(
+                os.path.join('simple', 'packages.html'),
+                packages=packages
+            )
+
+        raise Return(Page(body, content_type))
 
     @classmethod
     @threaded
-    @Cache(5, files_cache=True, ignore_self=True)
+    @Cache(DAY, ignore_self=True, generational=True)
     def pkg_list(cls):
         return list(Package.select().order_by(Package.lower_name))
 
     @classmethod
     @threaded
-    @Cache(5)
+    @Cache(DAY, ignore_self=True, tag=package_tag, generational=True)
     def rpc_package_releases(cls, package_name, show_hidden=False):
         package = Package.select().where(Package.name == package_name)
         return list(map(lambda x: str(x.name), package.versions()))
 
     @classmethod
     @threaded
-    @Cache(5)
+    @Cache(DAY, ignore_self=True, tag=package_tag, generational=True)
     def rpc_release_urls(cls, package_name, version):
         raise Return(
             list(
@@ -54,7 +72,7 @@ class PackagesHandler(BaseHandler, XMLRPCHandler):
 
     @classmethod
     @threaded
-    @Cache(5)
+    @Cache(DAY, ignore_self=True, generational=True)
     def rpc_list_packages(cls):
         return list(map(lambda x: x.name, Package.select()))
 
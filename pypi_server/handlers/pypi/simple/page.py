@@ -0,0 +1,99 @@
+# encoding: utf-8
+import gzip
+import hashlib
+import io
+from tornado.escape import utf8
+from tornado.httputil import _parse_header
+from tornado.web import HTTPError
+
+
+HTML = "text/html; charset=UTF-8"
+HTML_V1 = "application/vnd.pypi.simple.v1+html"
+JSON_V1 = "application/vnd.pypi.simple.v1+json"
+
+# PEP 691 and PEP 700 (sizes, upload times and versions)
+API_VERSION = "1.1"
+
+MEDIA_TYPES = {
+    "text/html": HTML,
+    HTML_V1: HTML_V1,
+    JSON_V1: JSON_V1,
+    "application/vnd.pypi.simple.latest+html": HTML_V1,
+    "application/vnd.pypi.simple.latest+json": JSON_V1,
+    "*/*": HTML,
+    "text/*": HTML,
+}
+
+
+# The content type of the response by the Accept header (PEP 691), the
+# "format" query argument overrides it.
+def negotiate(handler):
+    accept = handler.get_query_argument('format', None) or handler.request.headers.get('Accept')
+
+    if not accept:
+        return HTML
+
+    best, best_q = None, 0
+
+    for item in accept.split(','):
+        media_type, params = _parse_header(item)
+
+        try:
+            q = float(params.get('q', 1))
+        except ValueError:
+            continue
+
+        content_type = MEDIA_TYPES.get(media_type.lower())
+
+        # The first one wins with the same quality
+        if content_type is not None and q > best_q:
+            best, best_q = content_type, q
+
+    if best is None:
+        raise HTTPError(406)
+
+    return best
+
+
+# A rendered index page. It's cached until the package changes, so the
+# rendering, compression and hashing are done once per change.
+class Page(object):
+    __slots__ = ('body', 'gzipped', 'etag', 'content_type', 'proxy')
+
+    GZIP_LEVEL = 9
+
+    def __init__(self, body, content_type=HTML, proxy=False):
+        self.body = utf8(body)
+        self.content_type = content_type
+        self.proxy = proxy
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+        buf = io.BytesIO()
+
+        # No timestamp, the same body is compressed to the same bytes
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=self.GZIP_LEVEL, mtime=0) as f:
+            f.write(self.body)
+
+        self.gzipped = buf.getvalue()
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + len(self.body) + len(self.gzipped)
+
+    def send(self, handler):
+        gzipped = 'gzip' in handler.request.headers.get('Accept-Encoding', '')
+
+        handler.set_header("Content-Type", self.content_type)
+        handler.set_header("Vary", "Accept, Accept-Encoding")
+        # Each encoding is a representation with own strong validator
+        handler.set_header("ETag", '"%s%s"' % (self.etag, '-gzip' if gzipped else ''))
+
+        if handler.check_etag_header():
+            handler.set_status(304)
+            handler.finish()
+            return
+
+        if gzipped:
+            handler.set_header("Content-Encoding", "gzip")
+            handler.finish(self.gzipped)
+        else:
+            handler.finish(self.body)
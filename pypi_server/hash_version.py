@@ -1,25 +1,177 @@
 # encoding: utf-8
-from distutils.version import LooseVersion
-from functools import total_ordering
+import re
+from six import string_types
 
 
-@total_ordering
-class HashVersion(LooseVersion):
+# PEP 440, with the normalizations of the "Appendix B" regular expression
+VERSION_PATTERN = re.compile(r"""
+    ^\s*v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?:[-_.]?(?P<pre_l>alpha|a|beta|b|preview|pre|c|rc)[-_.]?(?P<pre_n>[0-9]+)?)?
+    (?:
+        -(?P<post_n1>[0-9]+)
+        |
+        [-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>[0-9]+)?
+    )?
+    (?:[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>[0-9]+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$
+""", re.VERBOSE | re.IGNORECASE)
+
+LEGACY_COMPONENT = re.compile(r"(\d+|[a-z]+|\.)", re.IGNORECASE)
+
+PRE_RELEASES = {
+    'a': 0, 'alpha': 0,
+    'b': 1, 'beta': 1,
+    'c': 2, 'rc': 2, 'pre': 2, 'preview': 2,
+}
+
+# Ranks of the pre-release part, a dev release of the final one
+# (1.0.dev1) goes before all the pre-releases (1.0a1).
+DEV_ONLY = -1
+FINAL = 3
+
+# Ends the release numbers, 1.0 goes before 1.0.1
+RELEASE_END = -1
+
+SEPARATORS = re.compile(r"[-_.]")
+
+
+# The sort keys are flat tuples of the numbers and strings, so comparison
+# is a single pass without nested tuples. A string is always preceded by
+# 0 and a number by 1, they never get compared to each other.
+def segments(parts):
+    key = []
+
+    for part in parts:
+        if part.isdigit():
+            key += (1, int(part))
+        else:
+            key += (0, part.lower())
+
+    return key
+
+
+def pep440_key(match):
+    release = [int(i) for i in match.group('release').split('.')]
+
+    # 1.0 == 1.0.0
+    while len(release) > 1 and not release[-1]:
+        release.pop()
+
+    post = match.group('post_n1') or match.group('post_n2')
+    post = -1 if post is None and not match.group('post_l') else int(post or 0)
+
+    dev = match.group('dev_l')
+    dev = (1, 0) if not dev else (0, int(match.group('dev_n') or 0))
+
+    if match.group('pre_l'):
+        pre = (PRE_RELEASES[match.group('pre_l').lower()], int(match.group('pre_n') or 0))
+    elif dev[0] == 0 and post < 0:
+        pre = (DEV_ONLY, 0)
+    else:
+        pre = (FINAL, 0)
+
+    key = [1, int(match.group('epoch') or 0)]
+    key += release
+    key.append(RELEASE_END)
+    key += pre
+    key.append(post)
+    key += dev
+
+    local = match.group('local')
+
+    if local:
+        # Numeric segments go after the alphanumeric ones
+        key += segments(SEPARATORS.split(local))
+
+    return tuple(key)
+
+
+def legacy_key(vstring):
+    # Not a PEP 440 version, it goes before all of them
+    return tuple([0] + segments(i for i in LEGACY_COMPONENT.findall(vstring) if i != '.'))
+
+
+def sort_key(vstring):
+    match = VERSION_PATTERN.match(vstring)
+    return pep440_key(match) if match else legacy_key(vstring)
+
+
+class HashVersion(object):
+    __slots__ = ('vstring', 'version', 'hidden')
+
+    # Parsed keys by the version string, the same versions share them
+    KEYS = {}
+    KEYS_MAX_SIZE = 2 ** 17
+
     def __init__(self, vstring=None):
-        LooseVersion.__init__(self, vstring=vstring)
-        self.version = tuple(map(str, self.version))
+        self.vstring = None
+        self.version = None
+
+        if vstring is not None:
+            self.parse(vstring)
+
+    def parse(self, vstring):
+        if not isinstance(vstring, string_types):
+            vstring = str(vstring)
+
+        key = self.KEYS.get(vstring)
+
+        if key is None:
+            if len(self.KEYS) >= self.KEYS_MAX_SIZE:
+                self.KEYS.clear()
+
+            key = self.KEYS[vstring] = sort_key(vstring)
+
+        self.vstring = vstring
+        self.version = key
+
+    @classmethod
+    def key(cls, other):
+        return cls(other).version
+
+    def __str__(self):
+        return self.vstring
+
+    def __repr__(self):
+        return "HashVersion(%r)" % self.vstring
 
     def __hash__(self):
-        return hash(self.__str__())
+        return hash(self.version)
 
     def __eq__(self, other):
-        if not isinstance(other, HashVersion):
-            other = HashVersion(str(other))
+        if isinstance(other, HashVersion):
+            return self.version == other.version
+        return self.version == self.key(other)
+
+    def __ne__(self, other):
+        if isinstance(other, HashVersion):
+            return self.version != other.version
+        return self.version != self.key(other)
 
-        return tuple(self.version) == tuple(other.version)
+    def __lt__(self, other):
+        if isinstance(other, HashVersion):
+            return self.version < other.version
+        return self.version < self.key(other)
+
+    def __le__(self, other):
+        if isinstance(other, HashVersion):
+            return self.version <= other.version
+        return self.version <= self.key(other)
 
     def __gt__(self, other):
-        if not isinstance(other, HashVersion):
-            other = HashVersion(str(other))
+        if isinstance(other, HashVersion):
+            return self.version > other.version
+        return self.version > self.key(other)
+
+    def __ge__(self, other):
+        if isinstance(other, HashVersion):
+            return self.version >= other.version
+        return self.version >= self.key(other)
 
-        return tuple(self.version) > tuple(other.version)
+    def __reduce__(self):
+        # The key is parsed again, the hidden flag of the releases is kept
+        hidden = getattr(self, 'hidden', None)
+        return HashVersion, (self.vstring,), (None, {'hidden': hidden}) if hidden is not None else None
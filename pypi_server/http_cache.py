@@ -4,10 +4,11 @@ from functools import wraps
 
 
 class HTTPCache(object):
-    def __init__(self, timeout, use_expires=False, expire_timeout=60):
+    def __init__(self, timeout, use_expires=False, expire_timeout=60, immutable=False):
         self.timeout = timeout
         self.expire_timeout = expire_timeout
         self.use_expires = use_expires
+        self.immutable = immutable
 
     def __call__(self, func):
         @wraps(func)
@@ -35,5 +36,8 @@ class HTTPCache(object):
                 )
                 handler.set_header(
                     "Cache-Control",
-                    "max-age={0}".format(kwargs.get('expire_timeout', self.expire_timeout))
+                    "max-age={0}{1}".format(
+                        kwargs.get('expire_timeout', self.expire_timeout),
+                        ", immutable" if kwargs.get('immutable', self.immutable) else ""
+                    )
                 )
\ No newline at end of file
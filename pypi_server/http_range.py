@@ -0,0 +1,121 @@
+# encoding: utf-8
+import os
+import re
+from binascii import hexlify
+
+
+# More ranges are ignored, the whole file is cheaper than
+# a thousand of tiny parts.
+MAX_RANGES = 64
+
+RANGE_SPEC = re.compile(r"^(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+# List of (start, end) pairs (both inclusive) or None for the whole file
+def parse(header, size):
+    unit, _, specs = (header or '').partition('=')
+
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+
+    if not specs:
+        return None
+
+    for spec in specs:
+        match = RANGE_SPEC.match(spec)
+
+        if not match or match.groups() == ('', ''):
+            return None
+
+        first, last = match.groups()
+
+        if not first:
+            # Suffix range, the last N bytes
+            length = int(last)
+
+            if length and size:
+                ranges.append((max(size - length, 0), size - 1))
+
+            continue
+
+        start = int(first)
+
+        if last and int(last) < start:
+            return None
+
+        end = int(last) if last else size - 1
+
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable("bytes */%d" % size)
+
+    ranges = coalesce(ranges)
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    return ranges
+
+
+def coalesce(ranges):
+    ordered = sorted(ranges)
+    result = [ordered[0]]
+
+    for start, end in ordered[1:]:
+        last_start, last_end = result[-1]
+
+        if start > last_end + 1:
+            result.append((start, end))
+        else:
+            result[-1] = (last_start, max(last_end, end))
+
+    # Keep the requested order unless something was merged
+    return ranges if len(result) == len(ranges) else result
+
+
+def content_range(start, end, size):
+    return "bytes %d-%d/%d" % (start, end, size)
+
+
+class Multipart(object):
+    def __init__(self, ranges, size, content_type='application/octet-stream', boundary=None):
+        self.ranges = ranges
+        self.size = size
+        self.boundary = boundary or hexlify(os.urandom(16)).decode('ascii')
+        self.part_type = content_type
+
+    @property
+    def content_type(self):
+        return "multipart/byteranges; boundary=%s" % self.boundary
+
+    def part_header(self, index, start, end):
+        return (
+            "%s--%s\r\nContent-Type: %s\r\nContent-Range: %s\r\n\r\n" % (
+                "\r\n" if index else "",
+                self.boundary,
+                self.part_type,
+                content_range(start, end, self.size),
+            )
+        ).encode('ascii')
+
+    @property
+    def trailer(self):
+        return ("\r\n--%s--\r\n" % self.boundary).encode('ascii')
+
+    def parts(self):
+        for index, (start, end) in enumerate(self.ranges):
+            yield self.part_header(index, start, end), start, end
+
+    def __len__(self):
+        return sum(
+            len(header) + end - start + 1 for header, start, end in self.parts()
+        ) + len(self.trailer)
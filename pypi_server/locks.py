@@ -0,0 +1,51 @@
+# encoding: utf-8
+import errno
+import fcntl
+import os
+
+
+# Cross-process locks of the storage files (e.g. "<file>.lock"). The holder
+# removes the lock file when it's done, so a waiter which got the lock of a
+# removed file tries again with the current one.
+def try_lock(path):
+    while True:
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            os.close(fd)
+
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                os.close(fd)
+                raise
+            stat = None
+
+        fstat = os.fstat(fd)
+
+        if stat is not None and (stat.st_dev, stat.st_ino) == (fstat.st_dev, fstat.st_ino):
+            return fd
+
+        os.close(fd)
+
+
+def unlock(fd, path=None):
+    try:
+        if path is not None:
+            # Removed while it's still held, the waiters notice it
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
@@ -0,0 +1,14 @@
+# encoding: utf-8
+import zipfile
+
+
+# The core metadata of a wheel (PEP 658): <name>-<version>.dist-info/METADATA
+def wheel_metadata(path):
+    with zipfile.ZipFile(path) as wheel:
+        for name in wheel.namelist():
+            parts = name.split('/')
+
+            if len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'METADATA':
+                return wheel.read(name)
+
+    return None
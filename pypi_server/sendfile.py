@@ -0,0 +1,71 @@
+# encoding: utf-8
+import errno
+import os
+from tornado.concurrent import Future
+from tornado.gen import coroutine, moment
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+
+
+# Bytes per system call, the event loop runs other callbacks between calls
+CHUNK_SIZE = 2 ** 24
+
+CLOSED_ERRORS = (errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN, errno.ESHUTDOWN)
+
+
+def supported(stream):
+    # TLS needs the data in the user space, SSLIOStream is a subclass of IOStream
+    return hasattr(os, 'sendfile') and type(stream) is IOStream and not stream.closed()
+
+
+def wait_writable(io_loop, fd):
+    future = Future()
+
+    def on_event(fd, events):
+        io_loop.remove_handler(fd)
+        future.set_result(events)
+
+    io_loop.add_handler(fd, on_event, IOLoop.WRITE | IOLoop.ERROR)
+    return future
+
+
+@coroutine
+def sendfile(stream, f, offset, count):
+    io_loop = IOLoop.current()
+    fd = f.fileno()
+    sock_fd = stream.socket.fileno()
+    # The stream has own handler of the socket, the IOLoop accepts
+    # one handler per descriptor.
+    waiter_fd = None
+
+    try:
+        while count > 0:
+            if stream.closed():
+                raise StreamClosedError()
+
+            try:
+                sent = os.sendfile(sock_fd, fd, offset, min(count, CHUNK_SIZE))
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    if waiter_fd is None:
+                        waiter_fd = os.dup(sock_fd)
+
+                    yield wait_writable(io_loop, waiter_fd)
+                    continue
+                elif e.errno == errno.EINTR:
+                    continue
+                elif e.errno in CLOSED_ERRORS:
+                    raise StreamClosedError(real_error=e)
+
+                raise
+
+            if not sent:
+                raise IOError("Unexpected end of file %r" % getattr(f, 'name', f))
+
+            offset += sent
+            count -= sent
+
+            yield moment
+    finally:
+        if waiter_fd is not None:
+            os.close(waiter_fd)
@@ -17,10 +17,12 @@ from tornado.web import Application
 from tornado.httpclient import AsyncHTTPClient
 from tornado.ioloop import PeriodicCallback
 from pypi_server import ROOT
-from pypi_server.cache import HOUR, Cache
+from pypi_server.blobs import Blobs
+from pypi_server.cache import HOUR, Cache, MemoryStorage
 from pypi_server.handlers.pypi.proxy.client import PYPIClient
 from pypi_server.db import init_db
-from pypi_server.db.packages import PackageFile
+from pypi_server.db.packages import Package, PackageFile
+from pypi_server.storage import Storage
 from pypi_server import handlers
 
 
@@ -38,6 +40,33 @@ define("debug", help="Use for attach a debugger",
 define("gzip", help="Compress responses (default False) [ENV:GZIP]",
        default=bool(os.getenv("GZIP")), type=bool)
 
+define("sendfile", help="Send package files by sendfile(2) when possible (default True) [ENV:SENDFILE]",
+       default=os.getenv("SENDFILE", "1") not in ("0", ""), type=bool)
+
+define("offload",
+       help='Let the fronting server send package files: "nginx" (X-Accel-Redirect) '
+            'or "apache" (X-Sendfile, also lighttpd). Disabled by default [ENV:OFFLOAD]',
+       default=os.getenv("OFFLOAD", ""), type=str)
+
+define("offload_prefix",
+       help='Internal nginx location of the package storage (default "/packages/") [ENV:OFFLOAD_PREFIX]',
+       default=os.getenv("OFFLOAD_PREFIX", "/packages/"), type=str)
+
+define("dedup",
+       help="Store identical package files once, hardlinked from a content-addressed "
+            "tree in the storage (default False) [ENV:DEDUP]",
+       default=bool(os.getenv("DEDUP")), type=bool)
+
+define("storage_quota",
+       help="Size limit of the stored package files (in megabytes, 0 is unlimited, default 0), "
+            "least recently used proxied files are removed above it [ENV:STORAGE_QUOTA]",
+       default=int(os.getenv("STORAGE_QUOTA", '0')), type=int)
+
+define("storage_disk_usage",
+       help="Usage limit of the storage volume (in percents, 0 is unlimited, default 0), "
+            "least recently used proxied files are removed above it [ENV:STORAGE_DISK_USAGE]",
+       default=int(os.getenv("STORAGE_DISK_USAGE", '0')), type=int)
+
 define("proxy-mode", help="Process X-headers on requests (default True) [ENV:PROXY_MODE]",
        default=bool(os.getenv('PROXY_MODE', '1')), type=bool)
 
@@ -99,6 +128,27 @@ define(
     default=default_cache_dir
 )
 
+define("cache_max_entries",
+       help="Maximum entries of the memory cache, 0 is unlimited (default 100000) [ENV:CACHE_MAX_ENTRIES]",
+       default=int(os.getenv("CACHE_MAX_ENTRIES", Cache.MAX_ENTRIES)), type=int)
+
+define("cache_max_size",
+       help="Approximate memory cache size (in megabytes, 0 is unlimited, default 512) [ENV:CACHE_MAX_SIZE]",
+       default=int(os.getenv("CACHE_MAX_SIZE", Cache.MAX_SIZE // (1024 * 1024))), type=int)
+
+define("cache_policy",
+       help="Memory cache eviction policy: lru or lfu (default lru) [ENV:CACHE_POLICY]",
+       default=os.getenv("CACHE_POLICY", MemoryStorage.LRU), type=str)
+
+define("cache_negative_entries",
+       help="Maximum cached misses (e.g. unknown packages), 0 is unlimited (default 10000) "
+            "[ENV:CACHE_NEGATIVE_ENTRIES]",
+       default=int(os.getenv("CACHE_NEGATIVE_ENTRIES", Cache.NEGATIVE_MAX_ENTRIES)), type=int)
+
+define("cache_disk_size",
+       help="Disk cache size (in megabytes, 0 is unlimited, default 1024) [ENV:CACHE_DISK_SIZE]",
+       default=int(os.getenv("CACHE_DISK_SIZE", Cache.DISK_MAX_SIZE // (1024 * 1024))), type=int)
+
 define('pypi_proxy', help='Enable proxying to PyPI (default True) [ENV:PYPI_PROXY]',
         type=bool, default=bool(os.getenv('PYPI_PROXY', '1')))
 
@@ -126,6 +176,10 @@ def run():
 
     options.storage = os.path.abspath(options.storage)
 
+    if options.offload not in ('', 'nginx', 'apache'):
+        log.error('Unknown offload mode "%s", use "nginx" or "apache"', options.offload)
+        exit(errno.EINVAL)
+
     if os.getuid() == 0 and options.user:
         pw = pwd.getpwnam(options.user)
         uid, gid = pw.pw_uid, pw.pw_gid
@@ -164,11 +218,20 @@ def run():
         io_loop = IOLoop.current()
 
         io_loop.run_sync(lambda: init_db(options.database))
+        Package.load_names()
+        Package.start_names_reload()
 
         if not (os.path.exists(options.cache_dir) and os.path.isdir(options.cache_dir)):
             os.makedirs(options.cache_dir)
 
-        Cache.CACHE_DIR = options.cache_dir
+        Cache.configure_disk(options.cache_dir, options.cache_disk_size * 1024 * 1024)
+        Cache.configure(
+            max_entries=options.cache_max_entries,
+            max_size=options.cache_max_size * 1024 * 1024,
+            policy=options.cache_policy,
+            negative_entries=options.cache_negative_entries,
+        )
+        Cache.start()
 
         log.info("Init thread pool with %d threads", options.pool_size)
         handlers.base.BaseHandler.THREAD_POOL = futures.ThreadPoolExecutor(options.pool_size)
@@ -214,6 +277,16 @@ def run():
         log.debug('Setting "%s" as storage', options.storage)
         PackageFile.set_storage(options.storage)
 
+        if options.dedup:
+            Blobs.configure(options.storage)
+            handlers.base.BaseHandler.THREAD_POOL.submit(Blobs.collect)
+
+        Storage.configure(
+            quota=options.storage_quota * 1024 * 1024,
+            disk_usage=options.storage_disk_usage,
+        )
+        Storage.start()
+
         log.debug("Starting main loop")
         io_loop.start()
     except Exception as e:
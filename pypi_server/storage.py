@@ -0,0 +1,189 @@
+# encoding: utf-8
+import datetime
+import errno
+import logging
+import os
+from threading import Lock
+from peewee import fn
+from tornado.concurrent import futures
+from tornado.ioloop import PeriodicCallback
+from pypi_server.blobs import Blobs
+from pypi_server.db.packages import PackageFile
+from pypi_server.locks import try_lock, unlock
+
+
+log = logging.getLogger(__name__)
+
+
+# Keeps the proxied files within the limits. The least recently used ones
+# are removed and marked as not fetched, FileHandler downloads them again
+# on demand. Uploaded files (no upstream url) are never touched.
+class Storage(object):
+    QUOTA = 0
+    DISK_USAGE = 0
+    # The eviction frees the space down to 90% of the limit
+    LOW_WATERMARK = 0.9
+    INTERVAL = 60
+    BATCH_SIZE = 100
+    # SQLite limits the number of the query parameters
+    UPDATE_BATCH_SIZE = 500
+
+    POOL = futures.ThreadPoolExecutor(1)
+    CHECKER = None
+    ACCESSED = set()
+    LOCK = Lock()
+
+    @classmethod
+    def configure(cls, quota=0, disk_usage=0):
+        cls.QUOTA = quota
+        cls.DISK_USAGE = disk_usage
+
+    @classmethod
+    def enabled(cls):
+        return bool(cls.QUOTA or cls.DISK_USAGE)
+
+    @classmethod
+    def start(cls):
+        if cls.enabled() and cls.CHECKER is None:
+            cls.CHECKER = PeriodicCallback(cls.schedule, cls.INTERVAL * 1000)
+            cls.CHECKER.start()
+
+    @classmethod
+    def schedule(cls):
+        def on_done(future):
+            exc = future.exception()
+            if exc is not None:
+                log.error("Storage check failed")
+                log.exception(exc)
+
+        future = cls.POOL.submit(cls.check)
+        future.add_done_callback(on_done)
+        return future
+
+    @classmethod
+    def touch(cls, pkg_file):
+        if cls.enabled():
+            with cls.LOCK:
+                cls.ACCESSED.add(pkg_file.id)
+
+    @classmethod
+    def flush(cls):
+        with cls.LOCK:
+            ids, cls.ACCESSED = list(cls.ACCESSED), set()
+
+        # The access time is as precise as the check interval
+        now = datetime.datetime.now()
+
+        for i in range(0, len(ids), cls.UPDATE_BATCH_SIZE):
+            PackageFile.update(accessed=now).where(
+                PackageFile.id << ids[i:i + cls.UPDATE_BATCH_SIZE]
+            ).execute()
+
+        return len(ids)
+
+    @classmethod
+    def check(cls):
+        cls.flush()
+        excess = cls.excess()
+
+        if excess > 0:
+            log.warning("Storage is over the limit, evicting %d bytes", excess)
+            return cls.evict(excess)
+
+        return 0
+
+    @classmethod
+    def excess(cls):
+        excess = 0
+
+        if cls.QUOTA:
+            used = PackageFile.select(
+                fn.COALESCE(fn.SUM(PackageFile.size), 0)
+            ).where(PackageFile.fetched == True).scalar() or 0
+
+            if used > cls.QUOTA:
+                excess = used - int(cls.QUOTA * cls.LOW_WATERMARK)
+
+        if cls.DISK_USAGE:
+            stat = os.statvfs(PackageFile.file.STORAGE)
+            total = stat.f_blocks * stat.f_frsize
+            used = total - stat.f_bavail * stat.f_frsize
+            limit = total * cls.DISK_USAGE // 100
+
+            if used > limit:
+                excess = max(excess, used - int(limit * cls.LOW_WATERMARK))
+
+        return excess
+
+    @classmethod
+    def candidates(cls, skipped):
+        query = PackageFile.select().where(
+            PackageFile.fetched == True,
+            PackageFile.url != None,
+        )
+
+        if skipped:
+            query = query.where(~(PackageFile.id << list(skipped)))
+
+        return query.order_by(
+            fn.COALESCE(PackageFile.accessed, PackageFile.ts).asc(),
+            PackageFile.id.asc(),
+        ).limit(cls.BATCH_SIZE)
+
+    @classmethod
+    def evict(cls, excess):
+        freed = 0
+        evicted = 0
+        skipped = set()
+
+        while freed < excess:
+            batch = list(cls.candidates(skipped))
+
+            if not batch:
+                log.warning("Nothing to evict, %d bytes are still over the limit", excess - freed)
+                break
+
+            for pkg_file in batch:
+                if freed >= excess:
+                    break
+
+                size = cls.evict_file(pkg_file)
+
+                if size is None:
+                    skipped.add(pkg_file.id)
+                    continue
+
+                freed += size
+                evicted += 1
+
+        log.info("Evicted %d files (%d bytes)", evicted, freed)
+        return freed
+
+    @classmethod
+    def evict_file(cls, pkg_file):
+        # Downloads hold the same lock, a file being fetched is skipped
+        lock_path = "%s.lock" % pkg_file.file
+        lock = try_lock(lock_path)
+
+        if lock is None:
+            return None
+
+        try:
+            # The row first: a request in between downloads the file again
+            PackageFile.update(fetched=False).where(PackageFile.id == pkg_file.id).execute()
+
+            try:
+                size = os.path.getsize(pkg_file.file)
+                os.remove(pkg_file.file)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                size = 0
+
+            if Blobs.enabled() and pkg_file.sha256:
+                Blobs.release(pkg_file.sha256)
+
+            log.debug('File "%s" evicted', pkg_file.basename)
+            return size
+        finally:
+            unlock(lock, lock_path)
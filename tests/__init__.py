@@ -1,6 +1,9 @@
 import os
+import shutil
+from pypi_server.cache import Cache
+from pypi_server.db.packages import Package, PackageFile
 from pypi_server.handlers.base import BaseHandler
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
 from pypi_server.db import init_db, DB
 from tornado.testing import AsyncHTTPTestCase
 from pypi_server.server import create_app
@@ -9,6 +12,7 @@ from tornado.testing import gen_test
 from tornado.httpclient import HTTPRequest, HTTPError
 from tornado.concurrent import futures
 from tornado.gen import Return, coroutine
+from tornado.options import options
 import logging
 
 
@@ -42,9 +46,47 @@ class TestCase(AsyncHTTPTestCase):
         super(TestCase, self).tearDown()
 
 
+class StorageTestCase(TestCase):
+    OPTIONS = ('pypi_proxy', 'offload', 'offload_prefix')
+
+    def setUp(self):
+        super(StorageTestCase, self).setUp()
+
+        self.storage = mkdtemp()
+        PackageFile.set_storage(self.storage)
+
+        self.options = dict((name, getattr(options, name)) for name in self.OPTIONS)
+        options.pypi_proxy = False
+
+        # The cached rows of the previous databases
+        Cache.bump()
+
+    def tearDown(self):
+        for name, value in self.options.items():
+            setattr(options, name, value)
+
+        shutil.rmtree(self.storage)
+        super(StorageTestCase, self).tearDown()
+
+    def create_file(self, name, version, filename, data=None, url=None):
+        package = Package.get_or_create(name, proxy=url is not None)
+        pkg_file = package.create_version(version).create_file(filename)
+        pkg_file.url = url
+
+        if data is not None:
+            with pkg_file.open('wb') as f:
+                f.write(data)
+
+            pkg_file.fetched = True
+
+        pkg_file.save()
+        return pkg_file
+
+
 __all__ = (
     "gen_test",
     "TestCase",
+    "StorageTestCase",
     "HTTPRequest",
     "HTTPError",
     "Return",
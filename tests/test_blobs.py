@@ -0,0 +1,63 @@
+# encoding: utf-8
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from pypi_server.blobs import Blobs
+
+
+class TestBlobs(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        Blobs.configure(self.path)
+
+    def tearDown(self):
+        Blobs.ROOT = None
+        shutil.rmtree(self.path)
+
+    def write(self, name, data):
+        path = os.path.join(self.path, name)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return path, hashlib.sha256(data).hexdigest()
+
+    def test_link(self):
+        first, sha256 = self.write('a-1.0.tar.gz', b'content')
+        second, _ = self.write('b-1.0.tar.gz', b'content')
+
+        self.assertFalse(Blobs.link(first, sha256))
+        self.assertTrue(Blobs.link(second, sha256))
+
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertEqual(os.stat(Blobs.path(sha256)).st_nlink, 3)
+        self.assertTrue(Blobs.path(sha256).startswith(os.path.join(self.path, '.blobs', sha256[:2], sha256[2:4])))
+
+        with open(second, 'rb') as f:
+            self.assertEqual(f.read(), b'content')
+
+    def test_release(self):
+        first, sha256 = self.write('a-1.0.tar.gz', b'content')
+        second, _ = self.write('b-1.0.tar.gz', b'content')
+        Blobs.link(first, sha256)
+        Blobs.link(second, sha256)
+
+        os.remove(first)
+        Blobs.release(sha256)
+        self.assertTrue(os.path.exists(Blobs.path(sha256)))
+
+        os.remove(second)
+        Blobs.release(sha256)
+        self.assertFalse(os.path.exists(Blobs.path(sha256)))
+
+    def test_collect(self):
+        first, sha256 = self.write('a-1.0.tar.gz', b'content')
+        kept, kept_sha256 = self.write('b-1.0.tar.gz', b'other')
+        Blobs.link(first, sha256)
+        Blobs.link(kept, kept_sha256)
+        os.remove(first)
+
+        self.assertEqual(Blobs.collect(), (1, len(b'content')))
+        self.assertTrue(os.path.exists(Blobs.path(kept_sha256)))
@@ -0,0 +1,20 @@
+# encoding: utf-8
+from tornado.testing import AsyncTestCase
+from pypi_server.bloom import BloomFilter
+
+
+class TestBloomFilter(AsyncTestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        names = ["package-%d" % i for i in range(1000)]
+        bloom.update(names)
+
+        self.assertEqual(len(bloom), 1000)
+        self.assertTrue(all(name in bloom for name in names))
+
+    def test_error_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        bloom.update("package-%d" % i for i in range(1000))
+
+        false_positives = sum(1 for i in range(10000) if u"other-%d" % i in bloom)
+        self.assertLess(false_positives, 300)
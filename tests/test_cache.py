@@ -0,0 +1,526 @@
+# encoding: utf-8
+import shutil
+import tempfile
+import time
+from threading import Thread, Event
+from tornado.gen import coroutine, sleep, Return, TimeoutError
+from tornado.testing import AsyncTestCase, gen_test
+from pypi_server.cache import Cache, DiskStorage, MemoryStorage, Result, canonical
+
+
+class TestMemoryStorage(AsyncTestCase):
+    def test_lru_eviction(self):
+        storage = MemoryStorage(max_entries=3)
+
+        for i in range(3):
+            storage.put(i, Result(i))
+
+        storage.get(0)
+        evicted = storage.put(3, Result(3))
+
+        self.assertEqual(evicted, [1])
+        self.assertEqual(sorted(storage.keys()), [0, 2, 3])
+        self.assertEqual(storage.info()['evictions'], 1)
+
+    def test_lfu_eviction(self):
+        storage = MemoryStorage(max_entries=3, policy=MemoryStorage.LFU)
+
+        for i in range(3):
+            storage.put(i, Result(i))
+
+        for i in (0, 0, 1, 2, 2):
+            storage.get(i)
+
+        self.assertEqual(storage.put(3, Result(3)), [1])
+        storage.get(3)
+        storage.get(3)
+
+        self.assertEqual(storage.put(4, Result(4)), [0])
+        self.assertEqual(sorted(storage.keys()), [2, 3, 4])
+
+    def test_size_limit(self):
+        storage = MemoryStorage(max_size=4096)
+
+        storage.put('a', Result('a' * 2048))
+        storage.put('b', Result('b' * 2048))
+
+        self.assertEqual(storage.keys(), ['b'])
+        self.assertLessEqual(storage.size, 4096)
+
+        storage.put('c', Result('c' * 8192))
+        self.assertNotIn('c', storage)
+        self.assertEqual(storage.info()['rejections'], 1)
+
+    def test_expiry(self):
+        storage = MemoryStorage()
+        now = time.time()
+
+        storage.put('a', Result(1), now - 1)
+        storage.put('b', Result(2), now + 60)
+        storage.put('c', Result(3), now + 1)
+        storage.put('c', Result(4), now + 60)
+        storage.put('d', Result(5))
+
+        self.assertIsNone(storage.get('a'))
+        self.assertEqual(storage.expire(now + 30), [])
+        self.assertEqual(storage.get('c').result, 4)
+
+        self.assertEqual(sorted(storage.expire(now + 90)), ['b', 'c'])
+        self.assertEqual(storage.keys(), ['d'])
+
+    def test_pop_and_clear(self):
+        storage = MemoryStorage()
+        storage.put('a', Result(1))
+
+        self.assertEqual(storage.pop('a').result, 1)
+        self.assertIsNone(storage.pop('a'))
+        self.assertEqual(storage.size, 0)
+
+        storage.put('b', Result(1))
+        storage.clear()
+        self.assertEqual(len(storage), 0)
+
+    def test_groups(self):
+        storage = MemoryStorage()
+        storage.put('a', Result(1), groups=('ns', ('ns', 'foo')))
+        storage.put('b', Result(2), groups=('ns', ('ns', 'bar')))
+        storage.put('c', Result(3), groups=('other',))
+
+        self.assertEqual(storage.pop_group(('ns', 'foo')), ['a'])
+        self.assertEqual(storage.pop_group(('ns', 'foo')), [])
+        self.assertEqual(storage.pop_group('ns'), ['b'])
+        self.assertEqual(storage.keys(), ['c'])
+        self.assertEqual(storage.info()['groups'], 1)
+
+
+class TestDiskStorage(AsyncTestCase):
+    def setUp(self):
+        super(TestDiskStorage, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.storage = DiskStorage()
+        self.storage.open(self.path)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.path)
+        super(TestDiskStorage, self).tearDown()
+
+    def test_put_get(self):
+        self.storage.put('key', 'ns', Result({'a': 1}), 60)
+
+        self.assertEqual(self.storage.get('key').result, {'a': 1})
+        self.assertIsNone(self.storage.get('other'))
+
+        reopened = DiskStorage()
+        reopened.open(self.path)
+
+        try:
+            self.assertEqual(reopened.get('key').result, {'a': 1})
+        finally:
+            reopened.close()
+
+    def test_expired(self):
+        result = Result(1)
+        self.storage.put('key', 'ns', result, -1)
+
+        self.assertIsNone(self.storage.get('key'))
+        self.assertEqual(self.storage.cleanup(), (1, 0))
+        self.assertEqual(self.storage.info()['entries'], 0)
+
+    def test_pop_keeps_newer_value(self):
+        old = Result(1)
+        self.storage.put('key', 'ns', old, 60)
+        time.sleep(0.01)
+        self.storage.put('key', 'ns', Result(2), 60)
+
+        self.assertEqual(self.storage.pop('key', old.ts), 0)
+        self.assertEqual(self.storage.get('key').result, 2)
+
+    def test_pop_namespace(self):
+        self.storage.put('a', 'ns', Result(1), 60, 'foo')
+        self.storage.put('b', 'ns', Result(2), 60, 'bar')
+        self.storage.put('c', 'other', Result(3), 60)
+
+        self.assertEqual(self.storage.pop_namespace('ns', 'foo'), 1)
+        self.assertIsNotNone(self.storage.get('b'))
+        self.assertEqual(self.storage.pop_namespace('ns'), 1)
+        self.assertIsNotNone(self.storage.get('c'))
+
+    def test_size_limit(self):
+        for i in range(10):
+            self.storage.put(str(i), 'ns', Result('x' * 1024), 60)
+
+        self.storage.max_size = 5 * 1024
+
+        expired, evicted = self.storage.cleanup()
+
+        self.assertEqual(expired, 0)
+        self.assertGreater(evicted, 0)
+        self.assertLessEqual(self.storage.size(), 5 * 1024)
+        self.assertIsNotNone(self.storage.get('9'))
+
+
+class TestCanonical(AsyncTestCase):
+    def test_unordered_containers(self):
+        self.assertEqual(
+            canonical({'b': 1, 'a': {3, 2, 1}}),
+            canonical(dict([('a', {1, 2, 3}), ('b', 1)])),
+        )
+
+    def test_types_are_distinguished(self):
+        self.assertNotEqual(canonical(1), canonical('1'))
+        self.assertNotEqual(canonical((1,)), canonical(1))
+        self.assertEqual(canonical(Cache), 'pypi_server.cache.Cache')
+
+
+class TestCache(AsyncTestCase):
+    def setUp(self):
+        super(TestCache, self).setUp()
+        Cache.CACHE.clear()
+        Cache.NEGATIVE.clear()
+
+    @gen_test
+    def test_disk_tier(self):
+        calls = []
+
+        @coroutine
+        @Cache(60, files_cache=True)
+        def func(arg):
+            calls.append(arg)
+            raise Return({'value': arg})
+            yield
+
+        path = tempfile.mkdtemp()
+        Cache.DISK.open(path)
+
+        try:
+            self.assertEqual((yield func(1)), {'value': 1})
+            yield Cache.disk(lambda: None)
+
+            keys = Cache.DISK.query("SELECT key FROM cache")
+            self.assertEqual(len(keys), 1)
+
+            # Like a restarted process
+            Cache.CACHE.clear()
+
+            self.assertEqual((yield func(1)), {'value': 1})
+            self.assertEqual(calls, [1])
+        finally:
+            Cache.DISK.close()
+            shutil.rmtree(path)
+
+    def test_invalidate(self):
+        calls = []
+
+        @Cache(60, tag=lambda name: name.lower())
+        def func(name, arg=None):
+            calls.append(name)
+            return name
+
+        @Cache(60)
+        def other(name):
+            return name
+
+        for name in ('foo', 'FOO', 'bar'):
+            func(name)
+
+        other('foo')
+
+        self.assertEqual(len(Cache.invalidate(func, 'Foo')), 2)
+
+        func('bar')
+        func('foo')
+        self.assertEqual(calls, ['foo', 'FOO', 'bar', 'foo'])
+
+        self.assertEqual(len(Cache.invalidate(func)), 2)
+        self.assertEqual(len(Cache.CACHE), 1)
+
+    def test_generational(self):
+        calls = []
+
+        @Cache(60, tag=lambda name: name.lower(), generational=True)
+        def func(name):
+            calls.append(name)
+            return name
+
+        @Cache(60, generational=True)
+        def listing():
+            calls.append(None)
+            return True
+
+        func('foo')
+        func('bar')
+        listing()
+
+        Cache.bump('foo')
+
+        func('Foo')
+        func('bar')
+        listing()
+        self.assertEqual(calls, ['foo', 'bar', None, 'Foo', None])
+
+        Cache.bump()
+
+        func('bar')
+        self.assertEqual(calls[-1], 'bar')
+
+    def test_negative(self):
+        calls = []
+
+        @Cache(60, negative_timeout=0.05)
+        def func(name):
+            calls.append(name)
+            raise LookupError(name)
+
+        for _ in range(3):
+            with self.assertRaises(LookupError):
+                func('foo')
+
+        self.assertEqual(calls, ['foo'])
+        self.assertEqual(len(Cache.NEGATIVE), 1)
+        self.assertEqual(len(Cache.CACHE), 0)
+
+        time.sleep(0.06)
+
+        with self.assertRaises(LookupError):
+            func('foo')
+
+        self.assertEqual(calls, ['foo', 'foo'])
+
+    @gen_test
+    def test_negative_empty_result(self):
+        calls = []
+
+        @coroutine
+        @Cache(60, negative_timeout=60)
+        def func(arg):
+            calls.append(arg)
+            raise Return(set())
+            yield
+
+        self.assertEqual((yield func(1)), set())
+        self.assertEqual((yield func(1)), set())
+        self.assertEqual(calls, [1])
+
+        Cache.invalidate(func)
+        yield func(1)
+        self.assertEqual(calls, [1, 1])
+
+    @gen_test
+    def test_snapshot(self):
+        @coroutine
+        @Cache(60, wait_timeout=1)
+        def func(arg):
+            yield sleep(0.01)
+            raise Return(arg)
+
+        namespace = Cache.hash_func(func)
+
+        yield [func(1), func(1)]
+        yield func(1)
+        yield func(2)
+
+        stats = Cache.snapshot()['functions'][namespace]
+
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(sum(count for bound, count in stats['miss_histogram']), 2)
+        self.assertEqual(stats['memory']['entries'], 2)
+        self.assertGreater(stats['memory']['size'], 0)
+
+    def test_eviction(self):
+        calls = []
+
+        @Cache(60)
+        def func(arg):
+            calls.append(arg)
+            return arg
+
+        Cache.configure(max_entries=2)
+
+        try:
+            for i in range(4):
+                self.assertEqual(func(i), i)
+
+            self.assertEqual(len(Cache.CACHE), 2)
+
+            func(3)
+            self.assertEqual(calls, [0, 1, 2, 3])
+        finally:
+            Cache.configure()
+
+    def test_expiry(self):
+        calls = []
+
+        @Cache(0.01)
+        def func(arg):
+            calls.append(arg)
+            return arg
+
+        func(1)
+        func(1)
+        time.sleep(0.02)
+
+        self.assertEqual(len(Cache.sweep()), 1)
+
+        func(1)
+        self.assertEqual(calls, [1, 1])
+
+    @gen_test
+    def test_coroutine_hit(self):
+        calls = []
+
+        @coroutine
+        @Cache(60)
+        def func(arg):
+            calls.append(arg)
+            raise Return(arg)
+            yield
+
+        self.assertEqual((yield func(1)), 1)
+        self.assertEqual((yield func(1)), 1)
+        self.assertEqual(calls, [1])
+
+    @gen_test
+    def test_stale_while_revalidate(self):
+        calls = []
+
+        @coroutine
+        @Cache(0.05, hard_timeout=60)
+        def func(arg):
+            calls.append(arg)
+            yield sleep(0.01)
+            raise Return(len(calls))
+
+        self.assertEqual((yield func(1)), 1)
+        yield sleep(0.1)
+
+        self.assertEqual((yield [func(1), func(1)]), [1, 1])
+        yield sleep(0.05)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual((yield func(1)), 2)
+
+    @gen_test
+    def test_stale_value_kept_on_refresh_error(self):
+        calls = []
+
+        @coroutine
+        @Cache(0.05, hard_timeout=60)
+        def func(arg):
+            calls.append(arg)
+            if len(calls) > 1:
+                raise RuntimeError("Upstream error")
+
+            raise Return(arg)
+            yield
+
+        self.assertEqual((yield func(1)), 1)
+        yield sleep(0.1)
+
+        self.assertEqual((yield func(1)), 1)
+        yield sleep(0.01)
+
+        self.assertEqual((yield func(1)), 1)
+        self.assertEqual(len(calls), 3)
+
+    def test_stale_while_revalidate_coroutines_only(self):
+        with self.assertRaises(ValueError):
+            @Cache(0.05, hard_timeout=60)
+            def func(arg):
+                return arg
+
+    @gen_test
+    def test_single_flight(self):
+        calls = []
+
+        @coroutine
+        @Cache(60)
+        def func(arg):
+            calls.append(arg)
+            yield sleep(0.05)
+            raise Return(arg)
+
+        futures = [func(1) for _ in range(10)]
+
+        yield sleep(0.01)
+        self.assertEqual([f['waiters'] for f in Cache.in_flight()], [9])
+
+        self.assertEqual((yield futures), [1] * 10)
+        self.assertEqual(calls, [1])
+        self.assertEqual(Cache.in_flight(), [])
+
+    @gen_test
+    def test_single_flight_error(self):
+        calls = []
+
+        @coroutine
+        @Cache(60)
+        def func(arg):
+            calls.append(arg)
+            yield sleep(0.01)
+            raise RuntimeError(arg)
+
+        futures = [func(1) for _ in range(3)]
+
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                yield future
+
+        with self.assertRaises(RuntimeError):
+            yield func(1)
+
+        self.assertEqual(calls, [1, 1])
+
+    @gen_test
+    def test_single_flight_wait_timeout(self):
+        calls = []
+
+        @coroutine
+        @Cache(60, wait_timeout=0.01)
+        def func(arg):
+            calls.append(arg)
+            yield sleep(0.05)
+            raise Return(arg)
+
+        leader = func(1)
+
+        with self.assertRaises(TimeoutError):
+            yield func(1)
+
+        self.assertEqual((yield leader), 1)
+        self.assertEqual((yield func(1)), 1)
+        self.assertEqual(calls, [1])
+
+    def test_single_flight_threads(self):
+        calls = []
+        started = Event()
+        release = Event()
+
+        @Cache(60)
+        def func(arg):
+            calls.append(arg)
+            started.set()
+            release.wait(5)
+            return arg
+
+        results = []
+        threads = [Thread(target=lambda: results.append(func(1))) for _ in range(5)]
+
+        threads[0].start()
+        started.wait(5)
+
+        for thread in threads[1:]:
+            thread.start()
+
+        while sum(f['waiters'] for f in Cache.in_flight()) < 4:
+            time.sleep(0.001)
+
+        release.set()
+
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(calls, [1])
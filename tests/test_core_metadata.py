@@ -0,0 +1,76 @@
+# encoding: utf-8
+import hashlib
+import io
+import os
+import zipfile
+
+from . import *
+
+
+METADATA = b"Metadata-Version: 2.1\nName: pkg\nVersion: 1.0\nRequires-Dist: six\n"
+WHEEL = 'pkg-1.0-py2.py3-none-any.whl'
+
+
+def make_wheel():
+    data = io.BytesIO()
+
+    with zipfile.ZipFile(data, 'w') as wheel:
+        wheel.writestr('pkg/__init__.py', b'')
+        wheel.writestr('pkg-1.0.dist-info/METADATA', METADATA)
+
+    return data.getvalue()
+
+
+class TestMetadataHandler(StorageTestCase):
+    URL = '/package/pkg/1.0/%s.metadata' % WHEEL
+
+    def setUp(self):
+        super(TestMetadataHandler, self).setUp()
+        self.pkg_file = self.create_file('pkg', '1.0', WHEEL, make_wheel())
+
+    def test_get(self):
+        response = self.fetch(self.URL)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, METADATA)
+        self.assertEqual(response.headers['ETag'], '"%s"' % hashlib.sha256(METADATA).hexdigest())
+
+    def test_head(self):
+        response = self.fetch(self.URL, method='HEAD')
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(int(response.headers['Content-Length']), len(METADATA))
+
+    def test_not_modified(self):
+        response = self.fetch(self.URL, headers={
+            'If-None-Match': '"%s"' % hashlib.sha256(METADATA).hexdigest(),
+        })
+
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b'')
+
+    def test_wheel_evicted(self):
+        # The metadata is enough, the wheel isn't fetched again
+        os.remove(self.pkg_file.file)
+
+        response = self.fetch(self.URL)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, METADATA)
+
+    def test_no_upstream(self):
+        # Neither the file nor an URL to fetch it from
+        self.create_file('pkg', '1.0', 'pkg-1.0-py3-none-any.whl')
+
+        response = self.fetch('/package/pkg/1.0/pkg-1.0-py3-none-any.whl.metadata')
+        self.assertEqual(response.code, 404)
+
+    def test_not_wheel(self):
+        self.create_file('pkg', '1.0', 'pkg-1.0.tar.gz', b'sdist')
+
+        response = self.fetch('/package/pkg/1.0/pkg-1.0.tar.gz.metadata')
+        self.assertEqual(response.code, 404)
+
+        response = self.fetch('/package/pkg/1.0/pkg-1.0.tar.gz')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'sdist')
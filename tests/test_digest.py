@@ -0,0 +1,47 @@
+# encoding: utf-8
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from pypi_server.digest import Digest, DigestWriter
+
+
+DATA = os.urandom(300000)
+
+
+class TestDigest(unittest.TestCase):
+    def test_writer(self):
+        f = io.BytesIO()
+        writer = DigestWriter(f)
+
+        for i in range(0, len(DATA), 1000):
+            writer.write(DATA[i:i + 1000])
+
+        self.assertEqual(f.getvalue(), DATA)
+        self.assertEqual(writer.digest.size, len(DATA))
+        self.assertEqual(writer.digest.md5.hexdigest(), hashlib.md5(DATA).hexdigest())
+        self.assertEqual(writer.digest.sha256.hexdigest(), hashlib.sha256(DATA).hexdigest())
+        self.assertEqual(writer.tell(), len(DATA))
+
+    def test_from_file(self):
+        fd, path = tempfile.mkstemp()
+
+        try:
+            os.write(fd, DATA)
+            os.close(fd)
+
+            digest = Digest.from_file(path)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(digest.size, len(DATA))
+        digest.verify(md5=hashlib.md5(DATA).hexdigest(), sha256=hashlib.sha256(DATA).hexdigest())
+
+    def test_verify(self):
+        digest = Digest()
+        digest.update(DATA)
+        digest.verify()
+
+        with self.assertRaises(ValueError):
+            digest.verify(md5=hashlib.md5(DATA).hexdigest(), sha256='invalid')
@@ -0,0 +1,335 @@
+# encoding: utf-8
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from tornado.concurrent import futures
+from tornado.gen import coroutine, sleep
+from tornado.httpclient import HTTPError
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+from pypi_server.cache import Cache
+from pypi_server.handlers.base import BaseHandler
+from pypi_server.handlers.pypi.proxy.download import Download
+
+
+DATA = os.urandom(3 * 1024 * 1024)
+
+
+class UpstreamHandler(RequestHandler):
+    @coroutine
+    def get(self):
+        for i in range(0, len(DATA), 256 * 1024):
+            self.write(DATA[i:i + 256 * 1024])
+            yield self.flush()
+            yield sleep(0.01)
+
+
+class RangeUpstreamHandler(RequestHandler):
+    requests = []
+
+    def get(self):
+        self.requests.append(self.request.headers.get('Range'))
+        self.set_header('ETag', '"etag"')
+        start = 0
+
+        if self.request.headers.get('Range'):
+            start = int(self.request.headers['Range'][len('bytes='):-1])
+            self.set_status(206)
+            self.set_header('Content-Range', 'bytes %d-%d/%d' % (start, len(DATA) - 1, len(DATA)))
+
+        self.write(DATA[start:])
+
+
+class DelayedUpstreamHandler(UpstreamHandler):
+    @coroutine
+    def get(self):
+        yield sleep(0.3)
+        yield super(DelayedUpstreamHandler, self).get()
+
+
+class FakePackage(object):
+    name = 'pkg'
+
+
+class FakePackageFile(object):
+    # The stored rows by id
+    ROWS = {}
+
+    def __init__(self, path, url, md5):
+        self.id = len(self.ROWS) + 1
+        self.ROWS[self.id] = self
+        self.package = FakePackage()
+        self.file = path
+        self.url = url
+        self.md5 = md5
+        self.sha256 = None
+        self.basename = os.path.basename(path)
+        self.fetched = False
+
+    @classmethod
+    def get(cls, id):
+        return cls.ROWS[id]
+
+    def save(self):
+        pass
+
+    def deduplicate(self):
+        pass
+
+    def extract_metadata(self):
+        pass
+
+
+class FakeHandler(object):
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    @coroutine
+    def flush(self):
+        yield sleep(0)
+
+
+class TestDownload(AsyncHTTPTestCase):
+    def setUp(self):
+        super(TestDownload, self).setUp()
+        self.path = tempfile.mkdtemp()
+
+        if BaseHandler.THREAD_POOL is None:
+            BaseHandler.THREAD_POOL = futures.ThreadPoolExecutor(2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestDownload, self).tearDown()
+
+    def get_app(self):
+        return Application([
+            ('/file', UpstreamHandler),
+            ('/range', RangeUpstreamHandler),
+            ('/delayed', DelayedUpstreamHandler),
+        ])
+
+    @gen_test(timeout=30)
+    def test_stream(self):
+        pkg_file = FakePackageFile(
+            os.path.join(self.path, 'pkg', 'pkg-1.0.tar.gz'),
+            self.get_url('/file'),
+            hashlib.md5(DATA).hexdigest()
+        )
+
+        generation = Cache.GENERATIONS.get('pkg')
+        download = Download(pkg_file).start()
+        handlers = [FakeHandler(), FakeHandler()]
+
+        yield [download.stream(handler) for handler in handlers] + [download.wait()]
+
+        self.assertEqual([h.data for h in handlers], [DATA, DATA])
+        self.assertTrue(pkg_file.fetched)
+        self.assertEqual(pkg_file.size, len(DATA))
+        self.assertEqual(pkg_file.sha256, hashlib.sha256(DATA).hexdigest())
+        self.assertFalse(os.path.exists(download.part))
+        self.assertNotEqual(Cache.GENERATIONS.get('pkg'), generation)
+
+        with open(pkg_file.file, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+
+    @gen_test(timeout=30)
+    def test_md5_mismatch(self):
+        pkg_file = FakePackageFile(os.path.join(self.path, 'pkg-1.0.tar.gz'), self.get_url('/file'), 'invalid')
+        download = Download(pkg_file).start()
+        handler = FakeHandler()
+
+        with self.assertRaises(IOError):
+            yield download.stream(handler)
+
+        # The body is never complete
+        self.assertLess(len(handler.data), len(DATA))
+        self.assertFalse(pkg_file.fetched)
+        self.assertFalse(os.path.exists(pkg_file.file))
+        self.assertFalse(os.path.exists(download.part))
+
+    @gen_test(timeout=30)
+    def test_coalesce(self):
+        requests = []
+
+        class CountingHandler(UpstreamHandler):
+            def prepare(self):
+                requests.append(self.request)
+
+        self._app.add_handlers('.*', [('/counted', CountingHandler)])
+
+        path = os.path.join(self.path, 'pkg-1.0.tar.gz')
+        url = self.get_url('/counted')
+        md5 = hashlib.md5(DATA).hexdigest()
+
+        first = Download.get(FakePackageFile(path, url, md5))
+        second = Download.get(FakePackageFile(path, url, md5))
+        self.assertIs(first, second)
+
+        handler = FakeHandler()
+        yield [first.stream(handler), second.wait()]
+
+        self.assertEqual(handler.data, DATA)
+        self.assertEqual(len(requests), 1)
+        self.assertNotIn(path, Download.ACTIVE)
+        self.assertFalse(os.path.exists(first.lock_path))
+
+    @gen_test(timeout=30)
+    def test_other_process(self):
+        pkg_file = FakePackageFile(
+            os.path.join(self.path, 'pkg-1.0.tar.gz'),
+            self.get_url('/file'),
+            hashlib.md5(DATA).hexdigest()
+        )
+
+        # The file lock is held by another "process"
+        with open(pkg_file.file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            download = Download(pkg_file).start()
+            handler = FakeHandler()
+            stream = download.stream(handler)
+
+            with open(pkg_file.file + '.part', 'wb') as part:
+                part.write(DATA)
+
+            yield sleep(Download.POLL_INTERVAL * 3)
+            os.rename(pkg_file.file + '.part', pkg_file.file)
+
+            # The row is stored by the other process too
+            stored = copy.copy(pkg_file)
+            stored.fetched = True
+            stored.size = len(DATA)
+            stored.sha256 = hashlib.sha256(DATA).hexdigest()
+            FakePackageFile.ROWS[pkg_file.id] = stored
+
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+        _, result = yield [stream, download.wait()]
+
+        self.assertEqual(handler.data, DATA)
+        self.assertIs(result, stored)
+        self.assertFalse(pkg_file.fetched)
+
+    def make_part(self, pkg_file, size):
+        os.makedirs(os.path.dirname(pkg_file.file))
+
+        with open(pkg_file.file + '.part', 'wb') as f:
+            f.write(DATA[:size])
+
+        with open(pkg_file.file + '.journal', 'w') as f:
+            json.dump({'url': pkg_file.url, 'etag': '"etag"'}, f)
+
+    @gen_test(timeout=30)
+    def test_resume(self):
+        del RangeUpstreamHandler.requests[:]
+        pkg_file = FakePackageFile(
+            os.path.join(self.path, 'pkg', 'pkg-1.0.tar.gz'),
+            self.get_url('/range'),
+            hashlib.md5(DATA).hexdigest()
+        )
+        self.make_part(pkg_file, 1000000)
+
+        download = Download(pkg_file).start()
+        handler = FakeHandler()
+        yield [download.stream(handler), download.wait()]
+
+        self.assertEqual(RangeUpstreamHandler.requests, ['bytes=1000000-'])
+        self.assertEqual(handler.data, DATA)
+        self.assertEqual(pkg_file.size, len(DATA))
+        self.assertFalse(os.path.exists(download.journal_path))
+
+        with open(pkg_file.file, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+
+    @gen_test(timeout=30)
+    def test_resume_ignored(self):
+        pkg_file = FakePackageFile(
+            os.path.join(self.path, 'pkg', 'pkg-1.0.tar.gz'),
+            self.get_url('/file'),
+            hashlib.md5(DATA).hexdigest()
+        )
+        self.make_part(pkg_file, 1000000)
+
+        download = Download(pkg_file).start()
+        yield download.wait()
+
+        with open(pkg_file.file, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+
+    @gen_test(timeout=30)
+    def test_restart_fails_readers(self):
+        pkg_file = FakePackageFile(
+            os.path.join(self.path, 'pkg', 'pkg-1.0.tar.gz'),
+            self.get_url('/delayed'),
+            hashlib.md5(DATA).hexdigest()
+        )
+        self.make_part(pkg_file, 1000000)
+
+        # The part is sent before the upstream ignores the Range request
+        download = Download(pkg_file).start()
+        handler = FakeHandler()
+
+        with self.assertRaises(IOError):
+            yield download.stream(handler)
+
+        self.assertEqual(handler.data, DATA[:999999])
+
+        yield download.wait()
+
+        with open(pkg_file.file, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+
+    @gen_test(timeout=30)
+    def test_other_process_restart(self):
+        pkg_file = FakePackageFile(
+            os.path.join(self.path, 'pkg-1.0.tar.gz'),
+            self.get_url('/file'),
+            hashlib.md5(DATA).hexdigest()
+        )
+
+        with open(pkg_file.file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            download = Download(pkg_file).start()
+            handler = FakeHandler()
+            stream = download.stream(handler)
+
+            with open(pkg_file.file + '.part', 'wb') as part:
+                part.write(DATA[:1000000])
+
+            yield sleep(Download.POLL_INTERVAL * 3)
+
+            # The other process started the part from the beginning
+            with open(pkg_file.file + '.part', 'wb') as part:
+                part.write(DATA[:1000])
+
+            with self.assertRaises(IOError):
+                yield stream
+
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+        yield download.wait()
+        self.assertEqual(handler.data, DATA[:999999])
+
+    @gen_test(timeout=30)
+    def test_failed_part_kept(self):
+        pkg_file = FakePackageFile(
+            os.path.join(self.path, 'pkg-1.0.tar.gz'),
+            self.get_url('/missing'),
+            hashlib.md5(DATA).hexdigest()
+        )
+
+        download = Download(pkg_file).start()
+
+        with self.assertRaises(HTTPError):
+            yield download.wait()
+
+        self.assertFalse(os.path.exists(pkg_file.file))
+        self.assertEqual(os.path.getsize(download.part), 0)
@@ -0,0 +1,230 @@
+# encoding: utf-8
+import hashlib
+import os
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from pypi_server.db.packages import PackageFile
+from tornado.gen import sleep
+from tornado.options import options
+from tornado.web import RequestHandler
+
+from . import *
+
+
+DATA = os.urandom(100000)
+
+
+class UpstreamHandler(RequestHandler):
+    @coroutine
+    def get(self, filename):
+        for i in range(0, len(DATA), 16384):
+            self.write(DATA[i:i + 16384])
+            yield self.flush()
+            yield sleep(0.01)
+
+
+class TestFileHandler(StorageTestCase):
+    URL = '/package/pkg/1.0/pkg-1.0.tar.gz'
+
+    def setUp(self):
+        super(TestFileHandler, self).setUp()
+        self.pkg_file = self.create_file('pkg', '1.0', 'pkg-1.0.tar.gz', DATA)
+
+    def test_get(self):
+        response = self.fetch(self.URL)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, DATA)
+        self.assertEqual(response.headers['ETag'], '"%s"' % hashlib.md5(DATA).hexdigest())
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response.headers)
+
+    def test_head(self):
+        response = self.fetch(self.URL, method='HEAD')
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(int(response.headers['Content-Length']), len(DATA))
+        self.assertEqual(response.headers['ETag'], '"%s"' % hashlib.md5(DATA).hexdigest())
+
+    def test_if_none_match(self):
+        for method in ('GET', 'HEAD'):
+            response = self.fetch(self.URL, method=method, headers={
+                'If-None-Match': 'W/"other", "%s"' % hashlib.md5(DATA).hexdigest(),
+            })
+            self.assertEqual(response.code, 304)
+            self.assertEqual(response.body, b'')
+
+        response = self.fetch(self.URL, headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, DATA)
+
+    def test_if_modified_since(self):
+        last_modified = self.fetch(self.URL, method='HEAD').headers['Last-Modified']
+
+        response = self.fetch(self.URL, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b'')
+
+        earlier = formatdate(mktime_tz(parsedate_tz(last_modified)) - 60, usegmt=True)
+        response = self.fetch(self.URL, headers={'If-Modified-Since': earlier})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, DATA)
+
+    def test_head_unknown_size(self):
+        # Not fetched yet, neither the size nor the md5 are known
+        self.create_file('pkg', '1.0', 'pkg-1.0.zip', url='http://localhost:1/pkg-1.0.zip')
+
+        response = self.fetch('/package/pkg/1.0/pkg-1.0.zip', method='HEAD')
+
+        self.assertEqual(response.code, 200)
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_head_size_from_disk(self):
+        self.pkg_file.size = None
+        self.pkg_file.save()
+
+        response = self.fetch(self.URL, method='HEAD')
+        self.assertEqual(int(response.headers['Content-Length']), len(DATA))
+
+    def test_not_found(self):
+        self.assertEqual(self.fetch('/package/pkg/1.0/pkg-1.1.tar.gz').code, 404)
+        self.assertEqual(self.fetch('/package/pkg/1.0/pkg-1.1.tar.gz', method='HEAD').code, 404)
+
+
+class TestRanges(StorageTestCase):
+    URL = '/package/pkg/1.0/pkg-1.0.tar.gz'
+
+    def setUp(self):
+        super(TestRanges, self).setUp()
+        self.pkg_file = self.create_file('pkg', '1.0', 'pkg-1.0.tar.gz', DATA)
+        self._app.add_handlers('.*', [('/upstream/(.*)', UpstreamHandler)])
+
+    def test_single(self):
+        response = self.fetch(self.URL, headers={'Range': 'bytes=100-199'})
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, DATA[100:200])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 100-199/%d' % len(DATA))
+        self.assertEqual(int(response.headers['Content-Length']), 100)
+
+    def test_suffix(self):
+        response = self.fetch(self.URL, headers={'Range': 'bytes=-10'})
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, DATA[-10:])
+
+    def test_multipart(self):
+        response = self.fetch(self.URL, headers={'Range': 'bytes=0-9,-10'})
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(int(response.headers['Content-Length']), len(response.body))
+
+        content_type = response.headers['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/byteranges; boundary='))
+        boundary = content_type.split('boundary=')[1].encode('ascii')
+
+        parts = response.body.split(b'--' + boundary)
+        self.assertEqual(parts[0], b'')
+        self.assertEqual(parts[-1], b'--\r\n')
+
+        expected = [(0, 9), (len(DATA) - 10, len(DATA) - 1)]
+
+        for part, (start, end) in zip(parts[1:-1], expected):
+            headers, _, body = part.partition(b'\r\n\r\n')
+            self.assertIn(
+                ('Content-Range: bytes %d-%d/%d' % (start, end, len(DATA))).encode('ascii'),
+                headers
+            )
+            self.assertEqual(body[:end - start + 1], DATA[start:end + 1])
+
+    def test_not_satisfiable(self):
+        response = self.fetch(self.URL, headers={'Range': 'bytes=%d-' % len(DATA)})
+
+        self.assertEqual(response.code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */%d' % len(DATA))
+
+    def test_if_range(self):
+        response = self.fetch(self.URL, headers={
+            'Range': 'bytes=100-199',
+            'If-Range': '"%s"' % hashlib.md5(DATA).hexdigest(),
+        })
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, DATA[100:200])
+
+        # Another version of the file, the whole one is sent
+        response = self.fetch(self.URL, headers={
+            'Range': 'bytes=100-199',
+            'If-Range': '"other"',
+        })
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, DATA)
+
+    def test_not_fetched(self):
+        self.create_file('pkg', '1.0', 'pkg-1.0.zip', url=self.get_url('/upstream/pkg-1.0.zip'))
+
+        # The range is served from the complete file
+        response = self.fetch('/package/pkg/1.0/pkg-1.0.zip', headers={'Range': 'bytes=50000-50099'})
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, DATA[50000:50100])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 50000-50099/%d' % len(DATA))
+
+        pkg_file = PackageFile.get(basename='pkg-1.0.zip')
+        self.assertTrue(pkg_file.fetched)
+        self.assertEqual(pkg_file.md5, hashlib.md5(DATA).hexdigest())
+
+
+class TestOffload(StorageTestCase):
+    URL = '/package/pkg/1.0/pkg-1.0.tar.gz'
+
+    def setUp(self):
+        super(TestOffload, self).setUp()
+        self.pkg_file = self.create_file('pkg', '1.0', 'pkg-1.0.tar.gz', DATA)
+        self._app.add_handlers('.*', [('/upstream/(.*)', UpstreamHandler)])
+
+    def test_nginx(self):
+        options.offload = 'nginx'
+
+        for prefix in ('/storage', '/storage/'):
+            options.offload_prefix = prefix
+            response = self.fetch(self.URL)
+
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, b'')
+            self.assertEqual(response.headers['X-Accel-Redirect'], '/storage/pkg/1.0/pkg-1.0.tar.gz')
+            self.assertEqual(response.headers['ETag'], '"%s"' % hashlib.md5(DATA).hexdigest())
+
+    def test_nginx_quoted(self):
+        options.offload = 'nginx'
+        options.offload_prefix = '/storage/'
+        self.create_file('pkg', '1.0', 'pkg-1.0+local.tar.gz', DATA)
+
+        response = self.fetch('/package/pkg/1.0/pkg-1.0%2Blocal.tar.gz')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/storage/pkg/1.0/pkg-1.0%2Blocal.tar.gz')
+
+    def test_apache(self):
+        options.offload = 'apache'
+        response = self.fetch(self.URL)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(response.headers['X-Sendfile'], self.pkg_file.file)
+        self.assertNotIn('X-Accel-Redirect', response.headers)
+
+    def test_not_fetched(self):
+        options.offload = 'nginx'
+        options.offload_prefix = '/storage/'
+        self.create_file('pkg', '1.0', 'pkg-1.0.zip', url=self.get_url('/upstream/pkg-1.0.zip'))
+
+        # The fronting server gets the downloaded file
+        response = self.fetch('/package/pkg/1.0/pkg-1.0.zip')
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/storage/pkg/1.0/pkg-1.0.zip')
+
+        pkg_file = PackageFile.get(basename='pkg-1.0.zip')
+        self.assertTrue(pkg_file.fetched)
+
+        with pkg_file.open() as f:
+            self.assertEqual(f.read(), DATA)
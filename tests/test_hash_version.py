@@ -0,0 +1,79 @@
+# encoding: utf-8
+import pickle
+import unittest
+from pypi_server.hash_version import HashVersion
+
+
+class TestHashVersion(unittest.TestCase):
+    def assertOrdered(self, versions):
+        parsed = [HashVersion(v) for v in versions]
+
+        for a, b in zip(parsed, parsed[1:]):
+            self.assertLess(a, b, "%s < %s" % (a, b))
+
+        self.assertEqual(list(map(str, sorted(reversed(parsed)))), versions)
+
+    def test_pep440_order(self):
+        self.assertOrdered([
+            '1.0.dev456',
+            '1.0a1',
+            '1.0a2.dev456',
+            '1.0a12.dev456',
+            '1.0a12',
+            '1.0b1.dev456',
+            '1.0b2',
+            '1.0b2.post345.dev456',
+            '1.0b2.post345',
+            '1.0rc1.dev456',
+            '1.0rc1',
+            '1.0',
+            '1.0+abc.5',
+            '1.0+abc.7',
+            '1.0+5',
+            '1.0.post456.dev34',
+            '1.0.post456',
+            '1.1.dev1',
+            '1.10',
+            '1!0.1',
+        ])
+
+    def test_normalization(self):
+        self.assertEqual(HashVersion('1.0'), HashVersion('1.0.0'))
+        self.assertEqual(HashVersion('1.0'), HashVersion('v1.0'))
+        self.assertEqual(HashVersion('1.0RC1'), HashVersion('1.0c1'))
+        self.assertEqual(HashVersion('1.0alpha'), HashVersion('1.0a0'))
+        self.assertEqual(HashVersion('1.0-1'), HashVersion('1.0.post1'))
+        self.assertEqual(HashVersion('1.0-r1'), HashVersion('1.0.post1'))
+        self.assertEqual(hash(HashVersion('1.0')), hash(HashVersion('1.0.0')))
+
+    def test_string(self):
+        version = HashVersion('1.0RC1')
+        self.assertEqual(str(version), '1.0RC1')
+        self.assertEqual(version.vstring, '1.0RC1')
+        self.assertEqual(version, '1.0rc1')
+        self.assertNotEqual(version, '1.0')
+        self.assertGreater('1.1', version)
+
+    def test_legacy(self):
+        self.assertOrdered(['dev', 'r1234', '2004d', '0.1'])
+
+    def test_set(self):
+        self.assertEqual(
+            set(HashVersion(v) for v in ('1.0', '1.0.0', '2.0')) - set([HashVersion('2.0')]),
+            set([HashVersion('1.0')])
+        )
+
+    def test_key_tuple(self):
+        self.assertIsInstance(HashVersion('1.0').version, tuple)
+        self.assertIs(HashVersion('1.2.3').version, HashVersion('1.2.3').version)
+
+    def test_pickle(self):
+        version = HashVersion('1.0b1')
+        version.hidden = True
+
+        restored = pickle.loads(pickle.dumps(version))
+        self.assertEqual(restored, version)
+        self.assertEqual(str(restored), '1.0b1')
+        self.assertTrue(restored.hidden)
+
+        self.assertFalse(hasattr(pickle.loads(pickle.dumps(HashVersion('1.0'))), 'hidden'))
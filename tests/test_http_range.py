@@ -0,0 +1,56 @@
+# encoding: utf-8
+from tornado.testing import AsyncTestCase
+from pypi_server import http_range
+
+
+class TestParse(AsyncTestCase):
+    def test_single(self):
+        self.assertEqual(http_range.parse("bytes=0-99", 1000), [(0, 99)])
+        self.assertEqual(http_range.parse("bytes=900-", 1000), [(900, 999)])
+        self.assertEqual(http_range.parse("bytes=-100", 1000), [(900, 999)])
+        self.assertEqual(http_range.parse("bytes=990-2000", 1000), [(990, 999)])
+        self.assertEqual(http_range.parse("bytes=-2000", 1000), [(0, 999)])
+
+    def test_multiple(self):
+        self.assertEqual(
+            http_range.parse("bytes=500-599, 0-99", 1000),
+            [(500, 599), (0, 99)]
+        )
+
+        # Overlapping ranges are merged
+        self.assertEqual(
+            http_range.parse("bytes=0-99,50-149,150-199,500-", 1000),
+            [(0, 199), (500, 999)]
+        )
+
+    def test_ignored(self):
+        for header in (None, "", "items=0-1", "bytes=", "bytes=a-b", "bytes=10-5", "bytes=-"):
+            self.assertIsNone(http_range.parse(header, 1000))
+
+        many = "bytes=" + ",".join("%d-%d" % (i * 10, i * 10 + 1) for i in range(100))
+        self.assertIsNone(http_range.parse(many, 1000))
+
+    def test_not_satisfiable(self):
+        for header in ("bytes=1000-", "bytes=-0", "bytes=2000-3000, 1500-"):
+            with self.assertRaises(http_range.RangeNotSatisfiable):
+                http_range.parse(header, 1000)
+
+
+class TestMultipart(AsyncTestCase):
+    def test_body(self):
+        data = b"0123456789" * 10
+        multipart = http_range.Multipart([(0, 4), (90, 99)], len(data), boundary="XXX")
+
+        body = b""
+        for header, start, end in multipart.parts():
+            body += header + data[start:end + 1]
+        body += multipart.trailer
+
+        self.assertEqual(len(body), len(multipart))
+        self.assertEqual(multipart.content_type, "multipart/byteranges; boundary=XXX")
+        self.assertEqual(
+            body,
+            b"--XXX\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 0-4/100\r\n\r\n01234"
+            b"\r\n--XXX\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 90-99/100\r\n\r\n"
+            b"0123456789\r\n--XXX--\r\n"
+        )
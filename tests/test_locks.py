@@ -0,0 +1,53 @@
+# encoding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+from pypi_server.locks import try_lock, unlock
+
+
+class TestLocks(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.lock_path = os.path.join(self.path, 'file.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_exclusive(self):
+        lock = try_lock(self.lock_path)
+        self.assertIsNotNone(lock)
+        self.assertIsNone(try_lock(self.lock_path))
+
+        unlock(lock)
+        self.assertTrue(os.path.exists(self.lock_path))
+
+        lock = try_lock(self.lock_path)
+        self.assertIsNotNone(lock)
+        unlock(lock)
+
+    def test_removed_when_done(self):
+        lock = try_lock(self.lock_path)
+        unlock(lock, self.lock_path)
+        self.assertFalse(os.path.exists(self.lock_path))
+
+        # Already removed by somebody else
+        lock = try_lock(self.lock_path)
+        os.remove(self.lock_path)
+        unlock(lock, self.lock_path)
+
+    def test_waiter_of_removed_file(self):
+        lock = try_lock(self.lock_path)
+        # A waiter opened the file before it was removed
+        stale = os.open(self.lock_path, os.O_RDWR)
+
+        try:
+            unlock(lock, self.lock_path)
+
+            # A newcomer gets the lock of the new file, the removed one doesn't count
+            lock = try_lock(self.lock_path)
+            self.assertIsNotNone(lock)
+            self.assertNotEqual(os.fstat(lock).st_ino, os.fstat(stale).st_ino)
+            unlock(lock, self.lock_path)
+        finally:
+            os.close(stale)
@@ -0,0 +1,50 @@
+# encoding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from pypi_server.metadata import wheel_metadata
+
+
+METADATA = b"Metadata-Version: 2.1\nName: pkg\nVersion: 1.0\nRequires-Dist: six\n"
+
+
+class TestWheelMetadata(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_wheel(self, files):
+        path = os.path.join(self.path, 'pkg-1.0-py2.py3-none-any.whl')
+
+        with zipfile.ZipFile(path, 'w') as wheel:
+            for name, data in files:
+                wheel.writestr(name, data)
+
+        return path
+
+    def test_metadata(self):
+        path = self.make_wheel([
+            ('pkg/__init__.py', b''),
+            ('pkg/METADATA', b'not this one'),
+            ('pkg-1.0.dist-info/WHEEL', b'Wheel-Version: 1.0\n'),
+            ('pkg-1.0.dist-info/METADATA', METADATA),
+        ])
+
+        self.assertEqual(wheel_metadata(path), METADATA)
+
+    def test_no_metadata(self):
+        path = self.make_wheel([('pkg/__init__.py', b'')])
+        self.assertIsNone(wheel_metadata(path))
+
+    def test_not_zip(self):
+        path = os.path.join(self.path, 'broken.whl')
+
+        with open(path, 'wb') as f:
+            f.write(b'broken')
+
+        with self.assertRaises(zipfile.BadZipfile):
+            wheel_metadata(path)
@@ -0,0 +1,64 @@
+# encoding: utf-8
+import unittest
+from tempfile import NamedTemporaryFile
+from peewee import SqliteDatabase
+from playhouse.migrate import SqliteMigrator, migrate
+from pypi_server.db import DB, Migrations
+from pypi_server.db.migrator import MIGRATIONS
+from pypi_server.db.migrator.actions import migrate_db
+
+
+# The last migration of the schema before the storage limits and the metadata
+BASELINE = 9
+BASELINE_DROPPED = ('sha256', 'accessed', 'metadata_sha256')
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.db_file = NamedTemporaryFile(mode="r+")
+        DB.initialize(SqliteDatabase(self.db_file.name))
+        self.migrator = SqliteMigrator(DB)
+        DB.create_tables([Migrations], safe=True)
+
+    def tearDown(self):
+        DB.close()
+        self.db_file.close()
+
+    def columns(self):
+        return set(c.name for c in DB.get_columns('packagefile'))
+
+    def indexes(self):
+        return set(i.name for i in DB.get_indexes('packagefile'))
+
+    def create_baseline(self):
+        for migration_id, name, func in sorted(MIGRATIONS, key=lambda x: x[0]):
+            if migration_id > BASELINE:
+                break
+
+            func(self.migrator, DB)
+            Migrations.create(id=migration_id, name=name)
+
+        # The tables are created by the current models, the newer columns go away
+        migrate(*[
+            self.migrator.drop_column('packagefile', column)
+            for column in BASELINE_DROPPED
+        ])
+
+        self.assertFalse(self.columns() & set(BASELINE_DROPPED))
+        self.assertNotIn('packagefile_accessed', self.indexes())
+
+    def test_upgrade(self):
+        self.create_baseline()
+        migrate_db(DB, Migrations, self.migrator)
+
+        self.assertTrue(set(BASELINE_DROPPED) <= self.columns())
+        self.assertIn('packagefile_accessed', self.indexes())
+        self.assertEqual(
+            Migrations.select().order_by(Migrations.id.desc()).get().id,
+            max(m[0] for m in MIGRATIONS)
+        )
+
+    def test_fresh(self):
+        migrate_db(DB, Migrations, self.migrator)
+        self.assertTrue(set(BASELINE_DROPPED) <= self.columns())
+        self.assertIn('packagefile_accessed', self.indexes())
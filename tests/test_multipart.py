@@ -0,0 +1,100 @@
+# encoding: utf-8
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from pypi_server.handlers.pypi.multipart import MultipartError, MultipartParser, SpooledFile
+
+
+BOUNDARY = b'--------------GHSKFJDLGDS7543FJKLFHRE75642756743254'
+CONTENT = os.urandom(100000) + b'\r\n--' + BOUNDARY[:-1] + b'\n\n'
+
+
+def make_body(newline, fields, files):
+    body = b''
+
+    for name, value in fields:
+        body += newline + b'--' + BOUNDARY + newline
+        body += b'Content-Disposition: form-data; name="' + name + b'"' + newline + newline
+        body += value
+
+    for name, filename, value in files:
+        body += newline + b'--' + BOUNDARY + newline
+        body += b'Content-Disposition: form-data; name="' + name + b'"; filename="' + filename + b'"' + newline
+        body += b'Content-Type: application/octet-stream' + newline + newline
+        body += value
+
+    return body + newline + b'--' + BOUNDARY + b'--' + newline
+
+
+class TestMultipartParser(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def spool(self, filename, content_type):
+        return SpooledFile(self.path, filename, content_type)
+
+    def parse(self, body, chunk_size):
+        parser = MultipartParser(BOUNDARY, self.spool)
+
+        for i in range(0, len(body), chunk_size):
+            parser.feed(body[i:i + chunk_size])
+
+        parser.close()
+        return parser
+
+    def check(self, newline):
+        body = make_body(
+            newline,
+            [(b':action', b'file_upload'), (b'name', b'pkg'), (b'description', b'a\r\nb\n')],
+            [(b'content', b'pkg-1.0.tar.gz', CONTENT)],
+        )
+
+        for chunk_size in (1, 7, 4096, len(body)):
+            parser = self.parse(body, chunk_size)
+
+            self.assertEqual(parser.arguments(), {
+                ':action': [b'file_upload'],
+                'name': [b'pkg'],
+                'description': [b'a\r\nb\n'],
+            })
+
+            upload = parser.files['content'][0]
+            self.assertEqual(upload.filename, 'pkg-1.0.tar.gz')
+            self.assertEqual(upload.digest.size, len(CONTENT))
+            self.assertEqual(upload.digest.sha256.hexdigest(), hashlib.sha256(CONTENT).hexdigest())
+
+            with open(upload.path, 'rb') as f:
+                self.assertEqual(f.read(), CONTENT)
+
+            parser.remove()
+            self.assertFalse(os.path.exists(upload.path))
+
+    def test_crlf(self):
+        self.check(b'\r\n')
+
+    def test_legacy_newlines(self):
+        self.check(b'\n')
+
+    def test_standard_preamble(self):
+        body = make_body(b'\r\n', [(b'name', b'pkg')], [])
+        parser = self.parse(body[2:], 3)
+        self.assertEqual(parser.arguments(), {'name': [b'pkg']})
+
+    def test_truncated(self):
+        body = make_body(b'\r\n', [(b'name', b'pkg')], [])
+        parser = MultipartParser(BOUNDARY, self.spool)
+        parser.feed(body[:-20])
+
+        with self.assertRaises(MultipartError):
+            parser.close()
+
+    def test_field_limit(self):
+        body = make_body(b'\r\n', [(b'name', b'x' * (MultipartParser.MAX_FIELD_SIZE + 1))], [])
+
+        with self.assertRaises(MultipartError):
+            self.parse(body, 2 ** 16)
@@ -0,0 +1,12 @@
+# encoding: utf-8
+import unittest
+from pypi_server import normalize_package_name
+
+
+class TestPackageName(unittest.TestCase):
+    def test_normalize(self):
+        for name in ('foo-bar', 'Foo_Bar', 'foo.bar', 'foo__bar', 'foo-_bar', 'FOO._-BAR'):
+            self.assertEqual(normalize_package_name(name), 'foo-bar')
+
+    def test_distinct(self):
+        self.assertNotEqual(normalize_package_name('foobar'), normalize_package_name('foo-bar'))
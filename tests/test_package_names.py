@@ -0,0 +1,45 @@
+# encoding: utf-8
+import shutil
+import tempfile
+from pypi_server.db.packages import Package, PackageFile
+
+from . import *
+
+
+class TestPackageNames(TestCase):
+    def setUp(self):
+        super(TestPackageNames, self).setUp()
+        self.path = tempfile.mkdtemp()
+        PackageFile.set_storage(self.path)
+        Package.load_names()
+
+    def tearDown(self):
+        Package.NAMES = None
+        shutil.rmtree(self.path)
+        super(TestPackageNames, self).tearDown()
+
+    def create_elsewhere(self, name):
+        # Created by another process, the post_save signal isn't seen here
+        package_id = Package.insert(name=name, lower_name=name.lower(), is_proxy=False).execute()
+        package = Package.get(id=package_id)
+        package.create_version('1.0').create_file('%s-1.0.tar.gz' % name)
+        return package
+
+    def test_created_by_other_process(self):
+        with self.assertRaises(LookupError):
+            Package.find('Other_Package')
+
+        package = self.create_elsewhere('Other_Package')
+        self.assertFalse(Package.maybe_exists('other-package'))
+
+        # The filter misses aren't cached, the reloaded filter finds it
+        Package.load_names()
+        self.assertEqual(Package.find('Other_Package').id, package.id)
+
+    def test_created_here(self):
+        package = Package(name='local', lower_name='local', is_proxy=False)
+        package.save()
+        package.create_version('1.0').create_file('local-1.0.tar.gz')
+
+        self.assertTrue(Package.maybe_exists('Local'))
+        self.assertEqual(Package.find('local').id, package.id)
@@ -0,0 +1,72 @@
+# encoding: utf-8
+import gzip
+import io
+from tornado.httputil import url_concat
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, RequestHandler
+from pypi_server.handlers.pypi.simple.page import HTML, HTML_V1, JSON_V1, Page, negotiate
+
+
+BODY = u"<html><body>%s</body></html>" % (u"<a href='/simple/pkg/'>pkg</a>\n" * 100)
+
+
+class PageHandler(RequestHandler):
+    PAGE = Page(BODY)
+
+    def get(self):
+        self.PAGE.send(self)
+
+
+class NegotiateHandler(RequestHandler):
+    def get(self):
+        self.write(negotiate(self))
+
+
+class TestPage(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([('/', PageHandler), ('/negotiate', NegotiateHandler)])
+
+    def negotiate(self, accept=None, url='/negotiate'):
+        response = self.fetch(url, headers={'Accept': accept} if accept else {})
+        return response.body.decode('utf-8') if response.code == 200 else response.code
+
+    def test_negotiate(self):
+        self.assertEqual(self.negotiate(), HTML)
+        self.assertEqual(self.negotiate('*/*'), HTML)
+        self.assertEqual(self.negotiate('text/html'), HTML)
+        self.assertEqual(self.negotiate(
+            'application/vnd.pypi.simple.v1+json, application/vnd.pypi.simple.v1+html; q=0.1, text/html; q=0.01'
+        ), JSON_V1)
+        self.assertEqual(self.negotiate('text/html; q=0.5, application/vnd.pypi.simple.latest+html'), HTML_V1)
+        self.assertEqual(self.negotiate('application/vnd.pypi.simple.v1+json; q=0, text/html'), HTML)
+        self.assertEqual(self.negotiate('application/json'), 406)
+        self.assertEqual(self.negotiate('text/html', url_concat('/negotiate', {'format': JSON_V1})), JSON_V1)
+
+    def test_identity(self):
+        response = self.fetch('/', decompress_response=False)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, BODY.encode('utf-8'))
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['ETag'], '"%s"' % PageHandler.PAGE.etag)
+
+    def test_gzip(self):
+        response = self.fetch('/', headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers["Vary"], "Accept, Accept-Encoding")
+
+        with gzip.GzipFile(fileobj=io.BytesIO(response.body)) as f:
+            self.assertEqual(f.read(), BODY.encode('utf-8'))
+
+    def test_not_modified(self):
+        etag = self.fetch('/').headers['ETag']
+        response = self.fetch('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+
+        response = self.fetch('/', headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.code, 200)
+
+    def test_stable_compression(self):
+        self.assertEqual(Page(BODY).gzipped, PageHandler.PAGE.gzipped)
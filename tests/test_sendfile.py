@@ -0,0 +1,57 @@
+# encoding: utf-8
+import hashlib
+import os
+import tempfile
+from tornado.gen import coroutine
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, RequestHandler
+from pypi_server import sendfile
+
+
+class FileHandler(RequestHandler):
+    @coroutine
+    def get(self):
+        path = self.application.settings['path']
+        size = os.path.getsize(path)
+        self.set_header("Content-Length", size)
+
+        with open(path, 'rb') as f:
+            stream = self.request.connection.stream
+            assert sendfile.supported(stream)
+
+            yield self.flush()
+            yield sendfile.sendfile(stream, f, 0, size)
+
+        self.request.connection._expected_content_remaining = 0
+        self.finish()
+
+
+class TestSendfile(AsyncHTTPTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(8 * 1024 * 1024 + 123))
+
+        super(TestSendfile, self).setUp()
+
+    def tearDown(self):
+        super(TestSendfile, self).tearDown()
+        os.remove(self.path)
+
+    def get_app(self):
+        return Application([('/', FileHandler)], path=self.path)
+
+    def get_http_client(self):
+        return SimpleAsyncHTTPClient(io_loop=self.io_loop, force_instance=True, max_body_size=16 * 1024 * 1024)
+
+    def test_sendfile(self):
+        with open(self.path, 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+
+        # Twice over the same keep-alive connection
+        for _ in range(2):
+            response = self.fetch('/')
+            self.assertEqual(response.code, 200)
+            self.assertEqual(hashlib.md5(response.body).hexdigest(), md5)
@@ -0,0 +1,98 @@
+# encoding: utf-8
+import hashlib
+import json
+import re
+from pypi_server.handlers.pypi.simple.page import API_VERSION, HTML, HTML_V1, JSON_V1
+
+from . import *
+from .test_core_metadata import METADATA, WHEEL, make_wheel
+
+
+SDIST = b'sdist'
+UPLOAD_TIME = re.compile(r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}Z$")
+
+
+class TestSimple(StorageTestCase):
+    URL = '/simple/pkg/'
+
+    def setUp(self):
+        super(TestSimple, self).setUp()
+        self.sdist = self.create_file('Pkg', '0.9', 'pkg-0.9.tar.gz', SDIST)
+        self.wheel = self.create_file('Pkg', '1.0', WHEEL, make_wheel())
+
+        version = self.wheel.version
+        version.requires_python = '>=2.7'
+        version.save()
+
+    def get(self, url, accept):
+        return self.fetch(url, headers={'Accept': accept})
+
+    def get_json(self, url):
+        response = self.get(url, JSON_V1)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], JSON_V1)
+        return json.loads(response.body.decode('utf-8'))
+
+    def test_negotiation(self):
+        for accept, content_type in (
+            ('text/html', HTML),
+            (HTML_V1, HTML_V1),
+            ('application/vnd.pypi.simple.latest+json', JSON_V1),
+            ('%s; q=0.5, %s' % (HTML_V1, JSON_V1), JSON_V1),
+        ):
+            response = self.get(self.URL, accept)
+
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.headers['Content-Type'], content_type)
+            self.assertIn('Accept', response.headers['Vary'])
+
+        self.assertEqual(self.get(self.URL, 'application/json').code, 406)
+
+    def test_html(self):
+        body = self.get(self.URL, HTML_V1).body.decode('utf-8')
+
+        self.assertIn('pkg-0.9.tar.gz#sha256=%s' % hashlib.sha256(SDIST).hexdigest(), body)
+        self.assertIn('data-core-metadata="sha256=%s"' % hashlib.sha256(METADATA).hexdigest(), body)
+
+    def test_project_json(self):
+        project = self.get_json(self.URL)
+
+        self.assertEqual(project['meta'], {'api-version': API_VERSION})
+        self.assertEqual(project['name'], 'pkg')
+        self.assertEqual(sorted(project['versions']), ['0.9', '1.0'])
+
+        files = dict((f['filename'], f) for f in project['files'])
+        self.assertEqual(sorted(files), ['pkg-0.9.tar.gz', WHEEL])
+
+        sdist = files['pkg-0.9.tar.gz']
+        self.assertEqual(sdist['url'], '/simple/pkg/0.9/pkg-0.9.tar.gz')
+        self.assertEqual(sdist['hashes'], {
+            'sha256': hashlib.sha256(SDIST).hexdigest(),
+            'md5': hashlib.md5(SDIST).hexdigest(),
+        })
+        self.assertEqual(sdist['size'], len(SDIST))
+        self.assertTrue(UPLOAD_TIME.match(sdist['upload-time']))
+        self.assertFalse(sdist['yanked'])
+        self.assertNotIn('requires-python', sdist)
+        self.assertNotIn('core-metadata', sdist)
+
+        wheel = files[WHEEL]
+        self.assertEqual(wheel['requires-python'], '>=2.7')
+        self.assertEqual(wheel['core-metadata'], {'sha256': hashlib.sha256(METADATA).hexdigest()})
+        self.assertEqual(wheel['dist-info-metadata'], wheel['core-metadata'])
+
+    def test_version_json(self):
+        project = self.get_json('/simple/pkg/1.0/')
+
+        self.assertEqual(project['versions'], ['1.0'])
+        self.assertEqual([f['filename'] for f in project['files']], [WHEEL])
+
+    def test_index_json(self):
+        index = self.get_json('/simple/')
+
+        self.assertEqual(index['meta'], {'api-version': API_VERSION})
+        self.assertIn({'name': 'Pkg'}, index['projects'])
+
+    def test_not_found(self):
+        self.assertEqual(self.get('/simple/other/', JSON_V1).code, 404)
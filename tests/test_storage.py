@@ -0,0 +1,99 @@
+# encoding: utf-8
+import datetime
+import os
+import shutil
+import tempfile
+from pypi_server.db.packages import Package, PackageFile, remove_file
+from pypi_server.locks import try_lock, unlock
+from pypi_server.storage import Storage
+
+from . import *
+
+
+class TestStorage(TestCase):
+    def setUp(self):
+        super(TestStorage, self).setUp()
+        self.path = tempfile.mkdtemp()
+        PackageFile.set_storage(self.path)
+
+        package = Package(name='pkg', lower_name='pkg', is_proxy=True)
+        package.save()
+        self.version = package.create_version('1.0')
+
+    def tearDown(self):
+        Storage.configure()
+        Storage.ACCESSED.clear()
+        shutil.rmtree(self.path)
+        super(TestStorage, self).tearDown()
+
+    def create_file(self, name, url=None, accessed=None):
+        pkg_file = self.version.create_file(name)
+
+        with pkg_file.open('wb') as f:
+            f.write(b'x' * 1024)
+
+        pkg_file = PackageFile.get(id=pkg_file.id)
+        pkg_file.fetched = True
+        pkg_file.url = url
+        pkg_file.accessed = accessed
+        pkg_file.save()
+        return pkg_file
+
+    def test_evict_lru(self):
+        now = datetime.datetime.now()
+        uploaded = self.create_file('pkg-1.0.zip', accessed=now - datetime.timedelta(days=10))
+        old = self.create_file('pkg-1.0.tar.gz', 'http://example.com/old', now - datetime.timedelta(days=1))
+        recent = self.create_file('pkg-1.0-py2.py3-none-any.whl', 'http://example.com/recent', now)
+
+        Storage.configure(quota=2560)
+        self.assertEqual(Storage.check(), 1024)
+
+        self.assertTrue(PackageFile.get(id=uploaded.id).fetched)
+        self.assertFalse(PackageFile.get(id=old.id).fetched)
+        self.assertTrue(PackageFile.get(id=recent.id).fetched)
+
+        self.assertTrue(os.path.exists(uploaded.file))
+        self.assertFalse(os.path.exists(old.file))
+        self.assertFalse(os.path.exists(old.file + '.lock'))
+        self.assertTrue(os.path.exists(recent.file))
+
+    def test_uploaded_kept(self):
+        uploaded = self.create_file('pkg-1.0.zip')
+
+        Storage.configure(quota=512)
+        self.assertEqual(Storage.check(), 0)
+        self.assertTrue(PackageFile.get(id=uploaded.id).fetched)
+
+    def test_touch(self):
+        pkg_file = self.create_file('pkg-1.0.tar.gz', 'http://example.com/file')
+
+        Storage.configure(quota=2 ** 30)
+        Storage.touch(pkg_file)
+        self.assertEqual(Storage.flush(), 1)
+        self.assertIsNotNone(PackageFile.get(id=pkg_file.id).accessed)
+
+    def test_downloading_skipped(self):
+        pkg_file = self.create_file('pkg-1.0.tar.gz', 'http://example.com/file')
+        lock = try_lock(pkg_file.file + '.lock')
+
+        try:
+            self.assertIsNone(Storage.evict_file(pkg_file))
+        finally:
+            unlock(lock)
+
+        self.assertTrue(os.path.exists(pkg_file.file))
+        self.assertEqual(Storage.evict_file(pkg_file), 1024)
+        self.assertFalse(os.path.exists(pkg_file.file + '.lock'))
+
+    def test_remove_side_files(self):
+        pkg_file = self.create_file('pkg-1.0.tar.gz', 'http://example.com/file')
+        side_files = [pkg_file.file + suffix for suffix in ('.metadata', '.part', '.journal', '.lock')]
+
+        for path in side_files:
+            with open(path, 'w'):
+                pass
+
+        remove_file(pkg_file)
+
+        self.assertFalse(os.path.exists(pkg_file.file))
+        self.assertEqual([path for path in side_files if os.path.exists(path)], [])
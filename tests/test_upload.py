@@ -0,0 +1,118 @@
+# encoding: utf-8
+import base64
+import hashlib
+import os
+from pypi_server.db.packages import Package, PackageFile
+from pypi_server.handlers.pypi.package import XmlRPC
+
+from . import *
+
+
+BOUNDARY = '----pypi-server-upload'
+FILENAME = 'pkg-1.0.tar.gz'
+DATA = os.urandom(4096)
+
+
+def multipart(fields, files):
+    body = []
+
+    for name, value in fields:
+        body.append(
+            '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (BOUNDARY, name, value)
+        )
+
+    for name, filename, data in files:
+        body.append(
+            '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n' % (BOUNDARY, name, filename)
+        )
+        body.append(data)
+        body.append('\r\n')
+
+    body.append('--%s--\r\n' % BOUNDARY)
+    return b''.join(i if isinstance(i, bytes) else i.encode('utf-8') for i in body)
+
+
+class TestUpload(StorageTestCase):
+    # Less than the upload, only the authorized users get the larger limit
+    MAX_BODY_SIZE = 1024
+
+    def setUp(self):
+        super(TestUpload, self).setUp()
+        Package(name='pkg', lower_name='pkg', is_proxy=False).save()
+
+    def get_httpserver_options(self):
+        return dict(max_body_size=self.MAX_BODY_SIZE)
+
+    def upload(self, password, data=DATA):
+        body = multipart(
+            [
+                (':action', 'file_upload'),
+                ('name', 'pkg'),
+                ('version', '1.0'),
+                ('md5_digest', hashlib.md5(data).hexdigest()),
+                ('sha256_digest', hashlib.sha256(data).hexdigest()),
+            ],
+            [('content', FILENAME, data)],
+        )
+
+        return self.fetch('/pypi', method='POST', body=body, headers={
+            'Content-Type': 'multipart/form-data; boundary=%s' % BOUNDARY,
+            'Authorization': 'Basic %s' % base64.b64encode(
+                ('admin:%s' % password).encode('utf-8')
+            ).decode('ascii'),
+        })
+
+    def spooled(self):
+        path = os.path.join(self.storage, XmlRPC.SPOOL_DIR)
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def test_upload(self):
+        response = self.upload('admin')
+        self.assertEqual(response.code, 200)
+
+        pkg_file = PackageFile.get(basename=FILENAME)
+        self.assertTrue(pkg_file.fetched)
+        self.assertEqual(pkg_file.size, len(DATA))
+        self.assertEqual(pkg_file.md5, hashlib.md5(DATA).hexdigest())
+        self.assertEqual(pkg_file.sha256, hashlib.sha256(DATA).hexdigest())
+
+        with pkg_file.open() as f:
+            self.assertEqual(f.read(), DATA)
+
+        # Renamed into place
+        self.assertEqual(self.spooled(), [])
+
+    def test_wrong_password(self):
+        response = self.upload('wrong', b'small')
+        self.assertEqual(response.code, 403)
+
+        # Rejected before the body was spooled
+        self.assertEqual(self.spooled(), [])
+        self.assertFalse(PackageFile.select().count())
+
+    def test_malformed_authorization(self):
+        response = self.fetch('/pypi', method='POST', body=b'', headers={
+            'Authorization': 'Basic',
+        })
+
+        self.assertEqual(response.code, 400)
+
+    def test_wrong_digest(self):
+        response = self.fetch('/pypi', method='POST', body=multipart(
+            [
+                (':action', 'file_upload'),
+                ('name', 'pkg'),
+                ('version', '1.1'),
+                ('md5_digest', hashlib.md5(b'other').hexdigest()),
+            ],
+            [('content', 'pkg-1.1.tar.gz', DATA)],
+        ), headers={
+            'Content-Type': 'multipart/form-data; boundary=%s' % BOUNDARY,
+            'Authorization': 'Basic %s' % base64.b64encode(b'admin:admin').decode('ascii'),
+        })
+
+        self.assertEqual(response.code, 406)
+
+        # The spooled file is removed with the request
+        self.assertEqual(self.spooled(), [])